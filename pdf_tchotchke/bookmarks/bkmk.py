@@ -35,6 +35,7 @@ Have fun and work fast!
 import os
 import re
 import argparse
+from itertools import compress
 
 import pdftotext 
 
@@ -50,29 +51,48 @@ RE_FLAGS = {
         "X" :   re.VERBOSE,
         "U" :   re.UNICODE
         }
+
+# Functions to print an entry (x,y,z) = (title,page,index) in each syntax
+def printCPDF(x,y,z):
+    return f"{z} \"{x}\" {y}\n"
+
+def printGS(x,y,z):
+    # the minus sign before the count leaves the menu unexpanded
+    return f"[ /Count -{z} /Page {y} /Title ({x}) /OUT pdfmark\n"
+
+def printPDFTK(x,y,z):
+    return f"BookmarkBegin\nBookmarkTitle: {x}\nBookmarkLevel: {z}\nBookmarkPageNumber: {y}\n"
+
 # Global variable syntax data structure for supported syntaxes
 BKMK_SYNTAX = {
         # Each syntax format has two properties: a print statement to
         # print data to that format and a sense statement which is a
-        # regular expression to detect whether a line has that format
-        # The data to print corresponds to (x,y,z) = (index,title,page)
+        # regular expression to detect whether a line has that format,
+        # compiled once here. Entries start at the beginning of a line, so the
+        # patterns are anchored there with ^ and re.M. The rest of the line
+        # after the last group isn't needed, so it isn't matched
+        # The data to print corresponds to (x,y,z) = (title,page,index)
         "cpdf"   : {
-            "print" : (lambda x,y,z: f"{z} \"{x}\" {y}\n"),
-            "sense" : r"(?P<index>\d+) \"(?P<title>.+)\" (?P<page>\d+).*"
+            "print" : printCPDF,
+            "sense" : re.compile(r"^(?P<index>\d+) \"(?P<title>.+)\" (?P<page>\d+)", re.M)
         # View information is given by "[<page number></view command>]"
             },
         "gs"    : {
-            # the minus sign before the count leaves the menu unexpanded
-            "print" : (lambda x,y,z: f"[ /Count -{z} /Page {y} /Title ({x}) /OUT pdfmark\n"),
-            "sense" : r"\[ /Count [-]*(?P<index>\d+) /Page (?P<page>\d+) /Title \((?P<title>.+)\) /OUT pdfmark.*"
+            "print" : printGS,
+            "sense" : re.compile(r"^\[ /Count [-]*(?P<index>\d+) /Page (?P<page>\d+) /Title \((?P<title>.+)\) /OUT pdfmark", re.M)
             # In addition, the /View [</view command>] option and its variations can be added
             },
         "pdftk" : {
-            "print" : (lambda x,y,z: f"BookmarkBegin\nBookmarkTitle: {x}\nBookmarkLevel: {z}\nBookmarkPageNumber: {y}\n"),
-            "sense"  : r"BookmarkBegin.*\nBookmarkTitle: (?P<title>.+).*\nBookmarkLevel: (?P<index>\d+).*\nBookmarkPageNumber: (?P<page>\d+).*"
+            "print" : printPDFTK,
+            # the entry spans several lines, so each line is kept to itself
+            # with [^\n] instead of depending on . not matching newlines
+            "sense"  : re.compile(r"^BookmarkBegin[^\n]*\nBookmarkTitle: (?P<title>[^\n]+)\nBookmarkLevel: (?P<index>\d+)[^\n]*\nBookmarkPageNumber: (?P<page>\d+)", re.M)
              }
     }
 
+# matches the first word of a title and all the decimals like .X.X after it
+CPDF_INDEX = re.compile(r"^\w+((?:\.[0-9]+)*)")
+
 
 def whichSyntax(data):
     '''
@@ -84,13 +104,20 @@ def whichSyntax(data):
     Returns:
         String or Error : "cpdf" or "gs" syntax, None if not any syntax
     '''
-    for e in list(BKMK_SYNTAX):
-        if bool(re.search(BKMK_SYNTAX[e]["sense"],data)):
+    # usually the file starts with a bookmark, so each syntax is first tried
+    # only at the first nonblank line, which fails quickly if it is another
+    head = data.lstrip()
+    for e in BKMK_SYNTAX:
+        if bool(BKMK_SYNTAX[e]["sense"].match(head)):
+            return e
+    # otherwise search the whole file, e.g. a pdftk dump with other data
+    for e in BKMK_SYNTAX:
+        if bool(BKMK_SYNTAX[e]["sense"].search(data)):
             return e
     raise UserWarning("The file is does not match any supported syntax")
 
 
-def convertSyntax(data,output_syntax=None,offset=0):
+def convertSyntax(data,output_syntax=None,offset=0,fp=None):
     '''
     Converts one bookmark file syntax into another file.
     Should detect the input syntax automatically and write
@@ -100,6 +127,7 @@ def convertSyntax(data,output_syntax=None,offset=0):
     to add the bookmarks.
     But maybe just do this for completeness.
     This can also renumber the pages by the given offset
+    If a file object fp is given, the result is written to it, see writeBkmkFile
     '''
     input_syntax = whichSyntax(data)
     if output_syntax == None:
@@ -112,12 +140,13 @@ def convertSyntax(data,output_syntax=None,offset=0):
             titles,
             [int(e) + offset for e in pages],
             indices,
-            index_input_syntax=input_syntax)
+            index_input_syntax=input_syntax,
+            fp=fp)
 
 
 def createTocFromText(data, output_syntax=None, 
                         pattern="(?P<title>.+)\n(?P<page>\d+)", 
-                        re_flags=re.U, edit=''):
+                        re_flags=re.U, edit='', fp=None):
     '''
     This function takes lines from a bookmarks in a raw text file and outputs them to a specified bookmark syntax.
     It also needs to ask interactively for the page offset to calculate the page numbering right.
@@ -128,6 +157,7 @@ def createTocFromText(data, output_syntax=None,
         String : a regular expression string containing (?P<page>\d+) and (?P<title>.+) groups to parse the page numbers and entry text from the input file
         re.FLAG : a regular expression flag defaulting to re.UNICODE
         String : a regexp to apply to all titles. e.g. to remove all leading numbers: r'^[\d\.]+\.'
+        File : (optional) a file object to write the entries to, see writeBkmkFile
 
     Return:
         String : the finalized bookmark entries
@@ -139,36 +169,35 @@ def createTocFromText(data, output_syntax=None,
     assert set(['title','page']) == set(re_pattern.groupindex.keys())
     
     # initial data for the first entry with page number > 0
-    matches = re_pattern.finditer(data)
-    for m in matches:
-        first_entry = m.group("title")
-        first_page  = m.group("page")
-        if int(first_page) > 0:
+    # (the last match is used if none has a page number > 0)
+    m = None
+    for m in re_pattern.finditer(data):
+        if int(m.group("page")) > 0:
             break
-        else:
-            continue
-
-    try:
-        # Ask for the page offset 
-        offset_str = input(f"Enter the page in the pdf for the following TOC entry:\nText: {first_entry}\nPage: {first_page}\n> ")
-    except NameError:
+    if m is None:
         raise UserWarning('No match to the pattern was found in the bookmark data')
+    first_entry, first_page = m.group("title", "page")
+
+    # Ask for the page offset 
+    offset_str = input(f"Enter the page in the pdf for the following TOC entry:\nText: {first_entry}\nPage: {first_page}\n> ")
 
     offset = int(offset_str) - int(first_page)
 
-    # OPTIONAL delete regexp from the titles
-    edits = {
-            False   :   (lambda x : x),
-            True    :   (lambda x : re.sub(edit,'',x))
-            }
-    
     titles,pages = extractBkmkFile(data,re_pattern)
 
+    # OPTIONAL delete regexp from the titles, compiled once
+    if bool(edit):
+        edit_re = re.compile(edit)
+        edited = [edit_re.sub('',e) for e in titles]
+    else:
+        edited = titles
+
     return writeBkmkFile(output_syntax,
-            [edits[bool(edit)](e) for e in titles],
+            edited,
             [int(e) + offset for e in pages],
             getCPDFIndexFromTitle([e for e in titles]),   
-            index_input_syntax="cpdf")
+            index_input_syntax="cpdf",
+            fp=fp)
 
 
 def getCPDFIndexFromTitle(title_list):
@@ -190,13 +219,18 @@ def getCPDFIndexFromTitle(title_list):
                 'Appendix', 'appendix', 'Apéndice', 'apéndice']
 
     # start indexing
-    indices = [1 for e in title_list]
+    indices = [0 for e in title_list]
+    # the number of titles containing each prefix, counted once per prefix
+    # since the prefixes of recurring titles repeat
+    counts = {}
     for i,title in enumerate(title_list):
         # This enforces no empty lines as well as getting index
-        while bool(re.match("^\w+" + indices[i] * "\.[0-9]+",title)):
-            indices[i] += 1
-        # subtract 1 because of construction of while loop
-        indices[i] -= 1
+        # the index is the number of decimals after the first word, and
+        # most titles have no period at all so they are left at 0
+        if "." in title:
+            m = CPDF_INDEX.match(title)
+            if bool(m):
+                indices[i] = m.group(1).count(".")
         # For things like exercises, which recur as subsections in the TOC
         # but would still be 0 in the previous system, promote them to index 1
         # if the first word in that title repeats at least 5 times in the TOC
@@ -205,10 +239,11 @@ def getCPDFIndexFromTitle(title_list):
         if indices[i] == 0:
             m = re.match(r'\D+',title)
             if bool(m):
-                if m.group(0) not in keywords:
-                    if (len([e for e in title_list 
-                            if m.group(0) in e])
-                            > 4):
+                prefix = m.group(0)
+                if prefix not in keywords:
+                    if prefix not in counts:
+                        counts[prefix] = sum(prefix in e for e in title_list)
+                    if counts[prefix] > 4:
                         indices[i] += 1
 
     return indices
@@ -226,108 +261,107 @@ def extractBkmkFile(data,pattern):
         "index" : 3
         }
 
-    pattern = re.compile(pattern)
+    # the syntaxes' patterns are already compiled
+    if not isinstance(pattern, re.Pattern):
+        pattern = re.compile(pattern)
     groups = dict(pattern.groupindex)
     # this is the case where we are creating a new bkmk which doesn't yet have indices
     if len(groups.keys()) == 2:
         del preferred_order['index']
 
     # in the preferred order, list all matches in each group as its own list (possibly a permutation bsed on the ordering of the matching group)
-    return [ [ e[groups[i]-1].strip() for e in re.findall(pattern,data) ] for i in list(preferred_order.keys()) ]
+    # the lists are filled in one pass over the matches
+    results = [ [] for i in preferred_order ]
+    for m in pattern.finditer(data):
+        d = m.groupdict('')
+        for i, e in enumerate(preferred_order):
+            results[i].append(d[e].strip())
+    return results
 
 
-def writeBkmkFile(output_syntax,titles, pages, indices,index_input_syntax=""):
+def writeBkmkFile(output_syntax,titles, pages, indices,index_input_syntax="",
+        fp=None):
     '''
     I was doing this over 5 times in the code so decided to centralize it
     This takes in lists with the titles, pages, indices, and exports a string in the requested format
+    If a file object fp is given, the entries are written to it one at a time
+    instead, without making the whole string, and None is returned
     '''
-    bkmks = ""
-    for i,_ in enumerate(indices):
-        bkmks +=  BKMK_SYNTAX[output_syntax]["print"](    
-                titles[i],pages[i],indices[i])
-    if output_syntax == index_input_syntax or not bool(index_input_syntax):
-        return bkmks 
-    else: # the index input syntax is not the same as the output syntax
-        return repairIndex(bkmks,index_input_syntax) # careful, recursion
-
-
-def repairIndex(bkmks, index_input_syntax):
+    if output_syntax != index_input_syntax and bool(index_input_syntax):
+        # the index input syntax is not the same as the output syntax
+        # the entries are used as they would be read back from a bookmark
+        # file, so those with a negative page (e.g. after an offset) are
+        # dropped since the syntaxes don't allow them, before the indices
+        # are converted
+        keep = [int(e) >= 0 for e in pages]
+        titles = [str(e).strip() for e in compress(titles, keep)]
+        pages = list(compress(pages, keep))
+        if not bool(pages):
+            raise UserWarning("No bookmarks with a page number >= 0 are left to write")
+        indices = repairIndex(compress(indices, keep), index_input_syntax,
+                output_syntax)
+    printer = BKMK_SYNTAX[output_syntax]["print"]
+    if fp is not None:
+        fp.writelines(printer(x,y,z) for x,y,z in zip(titles, pages, indices))
+        return
+    return "".join([printer(x,y,z) 
+            for x,y,z in zip(titles, pages, indices)])
+
+
+def repairIndex(indices, index_input_syntax, output_syntax):
     '''
-    This function preserves the syntax of a bkmk file but repairs the indices to match that syntax.
+    This function repairs the indices of a bkmk file to match the output syntax.
     This function is necessary because each of formats has its own convention.
     For instance the index in cpdf is starts from 0 and refers to how many levels deep into the TOC that entry is.
     The pdftk index is the same logic as cpdf but 1-indexed (add 1 to the cpdf index).
     In gs, the index given by /Count N  means that that entry has N child entries in the next sublevel.
 
     Arguments:
-        String  :   The bookmark file
-        String  :   (Optional) The index input syntax (this can be detected regardless)
+        List    :   The indices of the bookmarks
+        String  :   The index input syntax
+        String  :   The output syntax
 
     Returns:
-        String  :   The finalized bookmark file
+        List    :   The indices in the output syntax
     '''
-    output_syntax = whichSyntax(bkmks)
+    indices = [int(e) for e in indices]
 
     if output_syntax == index_input_syntax:
-        return bkmks
+        return indices
                     
     else:
-        titles, pages, indices = extractBkmkFile(bkmks,BKMK_SYNTAX[output_syntax]["sense"])
-        indices = [int(e) for e in indices]
-
         # convert!
         if output_syntax == "gs": # 
             # convert cpdf or pdftk index to gs index (works because this is a comparison method)
-            for i,e in enumerate(indices):
-                indices[i] = 0
-                try:
-                    # finds the number of subsequent indices 1 larger than the current one before the next index which has the same value as the current one
-                    counter = 0
-                    while indices[i + 1 + counter] != e:
-                        if indices[i + 1 + counter] == e + 1:
-                            indices[i] += 1
-                        counter += 1
-                except IndexError:
-                    pass
+            # finds the number of subsequent indices 1 larger than the current one before the next index which has the same value as the current one
+            # in one pass from the end, counting the entries at each level
+            # seen since the last entry one level up
+            counts = [0 for e in indices]
+            children = {}
+            for i in range(len(indices) - 1, -1, -1):
+                e = indices[i]
+                counts[i] = children.get(e + 1, 0)
+                children[e + 1] = 0
+                children[e] = children.get(e, 0) + 1
+            indices = counts
 
         else: # outputting to cpdf or pdftk
             if index_input_syntax == "gs":
                 # convert gs to cpdf
-                # in this loop, we go from end to beginning and get the cpdf index at each step
-                    # each run through this loops determines how many of the preceeding entries are parents of indices[i]
-                def recursiveDeleteTerminalBranches(roots):
-                    '''
-                    This takes in a list and removes terminal branches until there are none
-                    '''
-                    tree = roots[:]
-                    for i,e in list(enumerate(tree))[::-1]:
-                        if bool(e):
-                            try:
-                                # if every index in that range is zero, it is a terminal branch
-                                # note that if tree[i] is in the range(e) (i.e. len(tree[i+1:i+1+e]) < len(range(e)))
-                                # then there is match, so we won't delete it, as desired
-                                if tree[i+1:i+1+e] == [0 for x in range(e)]:
-                                    # replace e with a zero but remove e entries
-                                    del tree[i:i+e]
-                                    # prune the tree
-                                    tree = recursiveDeleteTerminalBranches(tree)
-                                else:
-                                    continue
-                            except IndexError:
-                                continue
-                        else:
-                            continue
-
-                    #print(tree)
-                    return tree
-
-                results = [0 for e in indices]
-                fast_search = 0
-                for i,_ in enumerate(indices):
-                    results[i] = len([x for x in recursiveDeleteTerminalBranches(indices[fast_search:i]) if x > 0])
-                    # if the entry has no parent, ignore all the preceeding entries
-                    if results[i] == 0:
-                        fast_search = i
+                # in this loop, we go from beginning to end keeping a stack of
+                # the number of children left to each open parent entry, so
+                # the cpdf index of an entry is the number of open parents
+                results = []
+                parents = []
+                for e in indices:
+                    # close the parents whose children have all been seen
+                    while parents and parents[-1] == 0:
+                        parents.pop()
+                    results.append(len(parents))
+                    if parents:
+                        parents[-1] -= 1
+                    if e > 0:
+                        parents.append(e)
                 indices = results
 
                 if output_syntax == "pdftk":
@@ -341,7 +375,7 @@ def repairIndex(bkmks, index_input_syntax):
             else: # converting cpdf to pdftk by adding 1
                 indices = [ e + 1 for e in indices ]
 
-    return writeBkmkFile(output_syntax, titles, pages, indices)
+    return indices
 
 
 def importPDFTOC(args):
@@ -416,14 +450,13 @@ def create(args):
     Calls the right functions to make things create
     '''
 
-    args.output.write(
-        createTocFromText(
-            args.input.read(), 
-            output_syntax=args.syntax,
-            pattern=args.pattern, 
-            re_flags=RE_FLAGS[args.re_flags],
-            edit=args.edit
-            )
+    createTocFromText(
+        args.input.read(), 
+        output_syntax=args.syntax,
+        pattern=args.pattern, 
+        re_flags=RE_FLAGS[args.re_flags],
+        edit=args.edit,
+        fp=args.output
         )
 
     return
@@ -433,12 +466,11 @@ def convert(args):
     '''
     Calls the right functions to make things convert
     '''
-    args.output.write(
-        convertSyntax(
-            args.input.read(), 
-            output_syntax=args.syntax,
-            offset=args.number
-            )
+    convertSyntax(
+        args.input.read(), 
+        output_syntax=args.syntax,
+        offset=args.number,
+        fp=args.output
         )
 
     return
@@ -21,28 +21,21 @@ def interleave(lines):
     '''
 
     # identify numerical lines representing page numbers
-    num_indices = []
-    entry_indices = []
-    output_index = 0
-    lines = [e.rstrip() for e in lines]   
+    entries = []
+    nums    = []
     for e in lines:
+        e = e.rstrip()
         # if there is an empty line, skip it, reducing the total number of lines in the output by 1 
         if not bool(e):
             continue
-        elif e.isdigit():
-            num_indices.append(output_index)
-        else:
-            entry_indices.append(output_index)
-        output_index += 1
+        (nums if e.isdigit() else entries).append(e)
+
+    # every entry needs its page number, otherwise lines would be dropped
+    if len(entries) != len(nums):
+        raise UserWarning(f"There are {len(entries)} entries but {len(nums)} page numbers: Check the input for missing or extra lines")
 
-    output = []
     # perform the permutations (entries alternate with numbers)
-    for i,_ in enumerate(lines):
-        if i % 2 == 0:
-            output.append(lines[entry_indices[int(i/2)]] + "   @" 
-                        + lines[num_indices[int(i/2)]] + "\n")
-        else:
-           continue
+    output = [e + "   @" + n + "\n" for e, n in zip(entries, nums)]
 
     return output
 
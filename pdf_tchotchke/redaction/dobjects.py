@@ -9,6 +9,15 @@ import re
 from .patterns import *
 from .parser import *
 
+def strip_delimiters(obj, n):
+    '''
+    Returns a my_match of the text of a pdf_match without the n characters of
+    the delimiters at each end, like the match of a literal search for it in
+    obj.finditer, but without compiling that search
+    '''
+    return my_match(CONTENTS.match(obj.text, n, len(obj.text) - n),
+                    obj.match.start())
+
 ### Direct Object Classes
 
 class pdf_stream(pdf_match):
@@ -53,9 +62,8 @@ class pdf_array(pdf_match):
     '''
     A class for arrays in pdfs
     '''
-    def parse(): #lol can't find an easier way to remove delimiters than to slice
-        con = re.compile(re.escape(next(self.find('arrays')).group(0))[2:-2])
-        return pdf_match(next(self.finditer(con)), self).parse()
+    def parse(self):
+        return pdf_match(strip_delimiters(self, 1), self).parse()
 
 
 class pdf_dict(pdf_match):
@@ -67,17 +75,20 @@ class pdf_dict(pdf_match):
         Break up a dictionary into key value pairs and evaluate the values into
         the appropriate classes
         '''
-        con = re.compile(re.escape(self.text[2:-2]))
-        items = pdf_match(next(self.finditer(con)), self).parse().els # pdf_objs
+        # the items are cached until the text of the dictionary changes
+        if getattr(self, 'parsed', (None,))[0] is self.text:
+            return self.parsed[1]
+        items = pdf_match(strip_delimiters(self, 2), self).parse().els # pdf_objs
         # sort the items by span
         assert len(items) > 0 and len(items) % 2 == 0
-        items = [e for _,e in sorted(zip([i.start() for i in items], items))]
+        items = sorted(items, key=(lambda e: e.start()))
         items = [(a, b) for a, b in zip(items[::2], items[1::2])]
         # assert they are of class : pdf_name ,pdf_obj, ... alternating
         for a, b in items:
             assert type(a)==pdf_name and issubclass(type(b), pdf_obj)
         # return a dictionary 
-        return {e[0] : e[1] for e in items}
+        self.parsed = (self.text, {e[0] : e[1] for e in items})
+        return self.parsed[1]
 
     def names(self, search=[]):
         '''
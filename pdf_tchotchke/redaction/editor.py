@@ -68,6 +68,7 @@ which can be deleted.
 
 import re 
 from io import BufferedReader, BufferedRandom
+from bisect import bisect_left
 
 from .patterns import *
 from .dobjects import *
@@ -91,25 +92,44 @@ class pdf_redactor(pdf_obj):
             text.seek(0)
         else:
             super().__init__(text, origin)
+        # the matches of some patterns in self.text, which are only searched
+        # for again after self.text is replaced
+        self.cache = {}
+
+    def find_cached(self, name):
+        '''
+        Returns a list of the matches of P[name] in self.text
+        The list is cached until self.text is replaced, e.g. by del_objs
+        '''
+        text, matches = self.cache.get(name, (None, None))
+        if text is not self.text:
+            matches = list(self.finditer(P[name]))
+            self.cache[name] = (self.text, matches)
+        return matches
 
     def get_parts(self):
         '''
         Return the header, indirect objects, xrefs, and footer as a list
         '''
-        m = P['pdf_hf'].match(self.text)
-        return [m.group(1), self.get_iobjs(), self.get_xrefs(), m.group(2)]
+        # the header is the text before the first object and the footer is
+        # the last %%EOF, which are found apart instead of matching the whole
+        # pdf with P['pdf_hf'], which may backtrack over all of it
+        first = self.find_cached('iobj')[0]
+        eof = P['pdf_f'].search(self.text)
+        return [self.text[:first.start()], self.get_iobjs(), self.get_xrefs(),
+                eof.group(0)]
 
     def get_iobjs(self):
         '''
         Returns a pdf_iobjs instance with every iobj in self
         '''
-        return pdf_iobjs(self.finditer(P['iobj']), origin=self)
+        return pdf_iobjs(iter(self.find_cached('iobj')), origin=self)
     
     def get_xrefs(self):
         '''
         Returns an pdf_xrefs instance with every pdf_xref in self
         '''
-        return pdf_xrefs(self.finditer(P['xrefs']), origin=self)
+        return pdf_xrefs(iter(self.find_cached('xrefs')), origin=self)
 
     def check_xref(self):
         '''
@@ -145,39 +165,40 @@ class pdf_redactor(pdf_obj):
         brazenly unaware of the structure of the pdf document other than how it
         rebuilds the xref table
         '''
-        def reverse_sort_objs(objs):
-            '''
-            Reverse sort objects by number to prevent issues while deleting
-            '''
-            return [o for _,o in sorted(zip([e.num for e in objs], objs), reverse=True)]
-
         objs = list(objs.objs())
-        obj_nums = []
-        for obj in reverse_sort_objs(objs):
-            # remove that object
-            p = re.compile(b''.join([b'\n', obj.num(), b' \d+ obj.+?endobj\n+']), re.S)
-            self.text = p.sub(b'\n', self.text)
-            # remove all object references to that object, update others
-            def update_refs(m):
-                if m.group(1) < obj.num():
-                    return m.group(0)
-                elif m.group(1) == obj.num():
-                    return b''
-                elif m.group(1) > obj.num():
-                    return b''.join([bytes(str(int(m.group(1))-1), 'utf-8'), m.group(2)])
-            self.text = re.sub(b'(\d+)( \d+ (?:R|obj))', update_refs, self.text)
-            # save the number of that object
-            obj_nums.append(int(obj.num()))
+        if objs:
+            # remove all of those objects in one pass, before renumbering
+            p = re.compile(b''.join([rb'(?<=\n)(?:', 
+                            b'|'.join([obj.num() for obj in objs]),
+                            rb') \d+ obj.+?endobj\n+']), re.S)
+            self.text = p.sub(b'', self.text)
+        # the numbers of those objects, in increasing order
+        obj_nums = sorted(set(int(obj.num()) for obj in objs))
+        # remove all object references to those objects and renumber the
+        # others in one pass: each number decreases by the number of deleted
+        # objects below it
+        def update_refs(m):
+            num = int(m.group(1))
+            i = bisect_left(obj_nums, num)
+            if i < len(obj_nums) and obj_nums[i] == num:
+                return b''
+            elif i == 0:
+                return m.group(0)
+            else:
+                return b''.join([bytes(str(num - i), 'utf-8'), m.group(2)])
+        self.text = re.sub(rb'(\d+)( \d+ (?:R|obj))', update_refs, self.text)
         # iterate over the xrefs and get the text of those to remove
         obj_refs = []
+        deleted = set(obj_nums)
         for xref in self.get_xrefs().xrefs():
             for block in xref.blocks():
                 for i, item in enumerate(block.items()):
-                    if block.start+i in obj_nums:
+                    if block.start()+i in deleted:
                         obj_refs.append(item.text)
-        # delete the xrefs corresponding to those objects
-        for ref in obj_refs:
-            self.text = re.sub(ref, b'', self.text)
+        # delete the xrefs corresponding to those objects in one pass
+        if obj_refs:
+            p = re.compile(b'|'.join([re.escape(ref) for ref in obj_refs]))
+            self.text = p.sub(b'', self.text)
             
         # repair xref
         self.make_xref(repair=True)
@@ -192,16 +213,17 @@ class pdf_redactor(pdf_obj):
         header, iobjs, xrefs, eof = self.get_parts()
         h_offset = P['pdf_h'].search(header).start()
         n_entries = 1 # 1 from the header
-        xtext = b''.join([b'0'*(10-h_offset),
-            bytes(str(h_offset), 'utf-8'), b' 65535 f \n'])
+        # the entries and objects are appended to a bytearray, which doesn't
+        # copy everything before them as bytes += would
+        xtext = bytearray(b''.join([b'0'*(10-h_offset),
+            bytes(str(h_offset), 'utf-8'), b' 65535 f \n']))
         if repair:
-            preamble = header
+            preamble = bytearray(header)
         # create the xitem for each indirect object
         for iobj in iobjs.iobjs():
             n_entries += 1
-            offset = bytes(str(iobj.start()), 'utf-8')
             # here is a quick and dirty solution
-            xtext += b''.join([b'0'*(10-len(offset)), offset, b' 00000 n \n'])
+            xtext += f'{iobj.start():010d} 00000 n \n'.encode('utf-8')
             # probably the more correct thing is to import the xrefs at the
             # beginning and keep the generation info but substitute the offset
             #xtext += re.sub(rb'\d{10}', b'0'*(10-len(offset))+offset, item)
@@ -60,25 +60,36 @@ class pdf_iobj(pdf_match):
         return self.match.group(3)
         
     def refs(self):
-        return (pdf_ref(x, origin=self) for x in P['ref'].finditer(self.text))
+        '''
+        Returns a list of the references in the object
+        The list is cached until the text of the object changes
+        '''
+        if getattr(self, 'found_refs', (None,))[0] is not self.text:
+            self.found_refs = (self.text, 
+                [pdf_ref(x, origin=self) for x in P['ref'].finditer(self.text)])
+        return self.found_refs[1]
 
     def parse(self):
         '''
         Break up the object's contents into a pdf_matches object.
         Takes in the contents of a pdf_obj object excluding the obj/endobj keywords
         '''
-        con = re.compile(re.escape(self.contents()))
-        return pdf_match(next(self.finditer(con)), self).parse()
+        # the contents are already a group of the match, so they are matched
+        # where they are instead of being searched for
+        start = self.match.start(3) - self.match.start()
+        con = CONTENTS.match(self.text, start, start + len(self.contents()))
+        return pdf_match(my_match(con, self.match.start()), self).parse()
 
     def dict(self):
         '''
         finds a returns the dictionaries in an object
         '''
-        dicts = [e for e in self.parse().els if type(e)==pdf_dict]
-        if len(dicts) == 1:
-            return dicts[0]
-        elif len(dicts) >= 1:
-            return dicts
+        dicts = (e for e in self.parse().els if isinstance(e, pdf_dict))
+        # a second dict is only looked for to know whether there is one
+        first = next(dicts, None)
+        second = next(dicts, None)
+        if second is None:
+            return first
         else:
-            return None
+            return [first, second, *dicts]
     
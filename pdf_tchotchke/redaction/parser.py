@@ -10,6 +10,8 @@ since it mainly uses regular expressions to dismantle a pdf
 '''
 
 import re
+from bisect import bisect_right
+from itertools import accumulate
 
 from .patterns import *
 
@@ -26,16 +28,20 @@ class my_match:
         self.match = match
         self.string = match.string
         self.offset = offset
+        # the offset spans of the groups, computed once when first asked for
+        self.spans = {}
 
     def span(self, group=0):
-        return((self.match.span(group)[0] + self.offset,
-               self.match.span(group)[1] + self.offset))
+        if group not in self.spans:
+            start, end = self.match.span(group)
+            self.spans[group] = (start + self.offset, end + self.offset)
+        return(self.spans[group])
 
     def start(self, group=0):
-        return(self.match.start(group)+self.offset)
+        return(self.span(group)[0])
 
     def end(self, group=0):
-        return(self.match.end(group)+self.offset)
+        return(self.span(group)[1])
 
     def group(self, *args, **kwargs):
         return(self.match.group(*args, **kwargs))
@@ -69,8 +75,9 @@ class pdf_obj:
         '''
         Calls pattern.finditer(self.text) to do a literal search in obj.
         repl can be a string or a function, pattern is a compiled re.Pattern
+        The matches have no offset, so they aren't wrapped in a my_match
         '''
-        yield from (my_match(e) for e in pattern.finditer(self.text))
+        yield from pattern.finditer(self.text)
 
     def sub(self, pattern, repl):
         '''
@@ -84,26 +91,27 @@ class pdf_obj:
         Give this function an iterator of spans (tuples such as (n, m) with m > n)
         and *IN PLACE* delete those corresponding indices from self.text
         '''
+        spans = list(spans)
         for span in spans:
             assert isinstance(span, tuple) and len(span)==2 and span[0] < span[1]
 
-        indices = set()
-        # delete duplicates
-        [indices.update(range(*span)) for span in spans]
-        new_spans = list()
-        end_span = 0
+        # merge the overlapping spans, in order
+        merged = []
+        for start, end in sorted(spans):
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        # keep the text between the merged spans. The pieces are slices of a
+        # memoryview, so they are only copied once, by the join
+        kept = []
         prev = 0
-        # recreate contiguous spans
-        for index in sorted(indices, reverse=True):
-            if index != prev-1:
-                if end_span:
-                    new_spans.append((prev, end_span))
-                end_span = index + 1
-            prev = index
-        new_spans.append((prev, end_span))
-        # note that the new spans are already in reverse order
-        for span in new_spans:
-            self.text = b''.join([self.text[:span[0]], self.text[span(1):]])
+        with memoryview(self.text) as view:
+            for start, end in merged:
+                kept.append(view[prev:start])
+                prev = end
+            kept.append(view[prev:])
+            self.text = b''.join(kept)
 
 
 class pdf_objs:
@@ -122,7 +130,9 @@ class pdf_match(pdf_obj):
     '''
     def __init__(self, m, origin):
         super().__init__(m.group(0), origin)
-        self.match = my_match(m)
+        # m is an re.Match or a my_match, so it is used as it is instead of
+        # being wrapped in a my_match with no offset
+        self.match = m
 
     def span(self, group=0):
         return self.match.span(group)
@@ -143,8 +153,11 @@ class pdf_match(pdf_obj):
         Calls pattern.finditer(self.match.string) to do a literal search in obj.
         repl can be a string or a function, pattern is a compiled re.Pattern
         '''
-        yield from (my_match(m, self.match.start())
-                    for m in pattern.finditer(self.text))
+        offset = self.match.start()
+        if offset:
+            yield from (my_match(m, offset) for m in pattern.finditer(self.text))
+        else:
+            yield from pattern.finditer(self.text)
 
     def find(self, option):
         '''
@@ -153,41 +166,46 @@ class pdf_match(pdf_obj):
         Though this function finds all the dictionaries, it only returns the
         highest level (unnested) consecutive ones
         '''
-        options =   {   'dicts' :   
-                        {   'start' : re.compile(b'<<'), 
-                            'end'   : re.compile(b'>>')},
-                        'arrays': 
-                        {   'start' : re.compile(b'\['),
-                            'end'   : re.compile(b']')},
-                    }
+        options = DELIMS
         assert option in options.keys()
-
-        ms   = list(self.finditer(options[option]['start']))
-        me   = list(self.finditer(options[option]['end']))
+        start, end = options[option]
+
+        # find the delimiters in order with bytes.find, which is quicker than
+        # a regexp for a literal. Each kind is found as finditer would
+        delims = []
+        i = self.text.find(start)
+        j = self.text.find(end)
+        while i >= 0 or j >= 0:
+            if j < 0 or 0 <= i < j:
+                delims.append((i, 1))
+                i = self.text.find(start, i + len(start))
+            else:
+                delims.append((j, -1))
+                j = self.text.find(end, j + len(end))
         try:
-            assert len(ms) == len(me)
+            assert sum([e[1] for e in delims]) == 0
         except AssertionError as e:
             raise AssertionError(f'{e}: mismatched delimiters')
         depth   = 0 # a counter to measure nesting depth.
         sbuffer = []
         d_spans = []
-        # iterate over the delimiters, sorted by start position
+        # iterate over the delimiters, by start position
         # to not select by depth, eliminate the depth variable and always append
-        for delim in [e for _,e in sorted(zip([i.start() for i in ms+me], ms+me))]:
-            if delim.group(0) in [b'<<', b'[']:
+        for pos, step in delims:
+            if step > 0:
                 depth += 1
-                sbuffer.append(delim.match.start())
+                sbuffer.append(pos)
             else:
                 depth -= 1
                 if depth == 0: # is not nested
-                    d_spans.append((sbuffer.pop(), delim.match.end()))
+                    d_spans.append((sbuffer.pop(), pos + len(end)))
                 else: # is nested (to include all matches, always do the line above)
                     sbuffer.pop()
 
-        for x in sorted(d_spans):
-             for y in self.finditer(re.compile(re.escape(
-                                      self.text[x[0]:x[1]]))):
-                 yield y
+        # the unnested spans are closed in order, so they are already sorted
+        # and each is matched where it is, instead of searched for
+        for x in d_spans:
+            yield my_match(CONTENTS.match(self.text, *x), self.match.start())
 
 
     def parse(self):
@@ -196,32 +214,54 @@ class pdf_match(pdf_obj):
         This is intended to parse an indirect object or dictionary 
         into constituent direct objects
         '''
+        # the classes of the direct objects are defined in dobjects, which
+        # imports this module, so they are only imported once they're needed
+        from .dobjects import (pdf_dict, pdf_array, pdf_stream, pdf_name,
+                                pdf_ref, pdf_bool, pdf_numeric, pdf_null)
         els = [] # short for elements
         ids = [] # short for indices (spans, really)
         dicts = (pdf_dict(x, origin=self) for x in self.find('dicts'))
         arrays = (pdf_array(x, origin=self) for x in self.find('arrays'))
-        streams = (pdf_stream(x, origin=self) for x in self.finditer(P['stream']))
-        booleans = (pdf_bool(x, origin=self) for x in self.finditer(P['bool']))
-        refs = (pdf_ref(x, origin=self) for x in self.finditer(P['ref']))
-        numerics = (pdf_numeric(x, origin=self) for x in self.finditer(P['numeric']))
-        nulls = (pdf_null(x, origin=self) for x in self.finditer(P['null']))
-        names = (pdf_name(x, origin=self) for x in self.finditer(P['name']))
+        # the other objects, by their key in P and in P['direct']
+        # careful, the order of this dict matters and should go from generic to specific
+        leaves = {  'stream' : pdf_stream, 'name' : pdf_name, 'ref' : pdf_ref,
+                    'bool' : pdf_bool, 'numeric' : pdf_numeric, 
+                    'null' : pdf_null   }
         
         # find the largest nonoverlapping objects and return those in a
         # dictionary sorted by type
-        def in_span(x, y):
-            if bool(y):
-                return any((z[0] <= x[0] <= x[1] <= z[1] for z in y))
-            else:
-                return False
-        # careful, the order of this list matters and should go from generic to specific
-        for t in [dicts, arrays, streams, names, refs, booleans, numerics, nulls]:
-            for o in t:
-                if in_span(o.span(), ids):
-                    continue
-                else:
-                    els.append(o)
-                    ids.append(o.span())
+        # the unnested dicts are disjoint and in order, and so are the arrays,
+        # so an array can only be inside the last dict starting before it
+        els += dicts
+        ids += [o.span() for o in els]
+        starts = [e[0] for e in ids]
+        for o in arrays:
+            j = bisect_right(starts, o.start()) - 1
+            if j < 0 or ids[j][1] < o.end():
+                els.append(o)
+        ids += [o.span() for o in els[len(starts):]]
+        # the other objects are found in one pass, so they don't overlap and
+        # are only tested against the dicts and arrays. They come in order, so
+        # they are swept against the dicts and arrays sorted by start and the
+        # furthest end reached by any of those which start before them
+        ids.sort()
+        reach = list(accumulate([e[1] for e in ids], max))
+        i = 0
+        offset = self.match.start()
+        found = { k : [] for k in leaves }
+        for m in P['direct'].finditer(self.text):
+            start, end = m.start() + offset, m.end() + offset
+            while i < len(ids) and ids[i][0] <= start:
+                i += 1
+            if i and reach[i-1] >= end:
+                continue
+            # each is matched again by its own pattern for its groups, e.g.
+            # the destination of a ref
+            k = m.lastgroup
+            found[k].append(leaves[k](my_match(P[k].match(self.text, 
+                                *m.span()), offset), origin=self))
+        for k in found:
+            els += found[k]
 
         return pdf_objs(els, origin=self)
 
@@ -7,15 +7,32 @@
 import re
 
 # Define Global variables    
+# The hex encodings of every possible byte, so that encoding a byte-string is
+# a lookup per byte instead of formatting each one
+HEX_TABLES = { f : [bytes(f'{e:{f}}', 'utf-8') for e in range(256)] for f in 'xX' }
+
+def encode_hex(s, fmt):
+    '''
+    Encodes a byte-string in hex like the 'x' or 'X' format specifications.
+    These don't pad bytes below 0x10 with a zero, so bytes.hex() is only used
+    when every byte has two hex digits
+    '''
+    if not s or min(s) >= 0x10:
+        return s.hex().encode('ascii') if fmt == 'x' \
+                else s.hex().upper().encode('ascii')
+    table = HEX_TABLES[fmt]
+    return b''.join([table[e] for e in s])
+
 PDF_STR_ENCODINGS = {
         # Using python's Format Specification mini-language
 
-        # literal string (default): as unicode
-        'c' : (lambda s : b''.join(bytes(f'{e:c}','utf-8') for e in s)),
+        # literal string (default): as unicode, where f'{e:c}' is chr(e)
+        'c' : (lambda s : bytes(s) if s.isascii()
+                            else s.decode('latin-1').encode('utf-8')),
         # Hex uncapitalized
-        'x' : (lambda s : b''.join(bytes(f'{e:x}','utf-8') for e in s)), 
+        'x' : (lambda s : encode_hex(s, 'x')), 
         # Hex capitalized
-        'X' : (lambda s : b''.join(bytes(f'{e:X}','utf-8') for e in s))
+        'X' : (lambda s : encode_hex(s, 'X'))
         }
 
 C = {# This is a collection of character types in pdfs
@@ -34,6 +51,7 @@ P = {# This is a collection of relevant patterns for parsing pdfs
 
     # Structural elements
     'pdf_h' :   re.compile(b'%PDF'),
+    'pdf_f' :   re.compile(b'%%EOF\n*$'),
     'pdf_hf':   re.compile(b'^(.+?)(?:\d+ \d+ obj.+endobj\n+)+(?:xref.+)(%%EOF\n*)$', re.DOTALL),
     'iobjs' :   re.compile(b'(\d+ \d+ obj.+?endobj\n+)+', re.DOTALL),
     'iobj'  :   re.compile(b'(\d+) (\d+) obj\n*(.+?)\n*endobj\n+', re.DOTALL),
@@ -58,12 +76,28 @@ P = {# This is a collection of relevant patterns for parsing pdfs
     'bool'  :   re.compile(b''.join([rb'true|false', C['ws'], b'*'])),
     'name'  :   re.compile(b''.join([b'/', C['name'], b'+'])),
     'null'  :   re.compile(b''.join([b'null', C['ws'], b'*'])),
-    'numeric':  re.compile(b''.join([b'[+-]?\d*\.?\d+'])), 
+    'numeric':  re.compile(b''.join([b'[+-]?(?:\d+(?:\.\d+)?|\.\d+)'])), 
     # optional sign, one or more numerals, at most one decimal point
+    # (the same as [+-]?\d*\.?\d+, but an integer doesn't backtrack)
     # read the reference about what is allowed in strings
     # also exclude the possibility of dictionary
     'string':   re.compile(b''.join([b'(?<!<)[[<]', b'.*?', b'[]>](?!>)', 
                             C['ws'], b'*']))
     }
+# Matches the whole of a string, to get a part of an object as a match by
+# matching it within a span, without searching for it
+CONTENTS = re.compile(b'.*', re.DOTALL)
+# The delimiters (start, end) of dicts and arrays, which pdf_match.find pairs
+# up since these objects may be nested. They are literals found by bytes.find
+DELIMS = {  'dicts' :   (b'<<', b'>>'),
+            'arrays':   (b'[', b']'),
+        }
+# The direct objects other than dicts and arrays, which can't overlap each
+# other, as one alternation whose named group is the key of the pattern in P.
+# Where several match, the first listed one is found
+P['direct'] = re.compile(b'|'.join([b''.join([b'(?P<', k.encode(), b'>', 
+                                                P[k].pattern, b')'])
+                for k in ['stream', 'name', 'ref', 'bool', 'numeric', 'null']]),
+                re.DOTALL)
 
 
@@ -14,9 +14,12 @@ PyPDF2/4 or pdfrw for the compression instead.
 
 import os
 import re
+import shutil
 import argparse
 import subprocess
+from itertools import repeat
 from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 
 from pdf_tchotchke.redaction import redact, whiteout, whiteout_re
 
@@ -43,6 +46,10 @@ PDF_PROGRAMS = {
         'merge'     :   (lambda x, y: rf'pdftk {x} cat output {y} compress')},
     }
 
+# buffer size for reading and writing the pdfs during redaction
+# (the default io.DEFAULT_BUFFER_SIZE of 8 KiB makes many small syscalls)
+IO_BUFFER_SIZE = 1 << 16
+
 
 def get_tmp_file_names(file_pattern):
     '''
@@ -52,22 +59,25 @@ def get_tmp_file_names(file_pattern):
     # make tmp dirs
     prefix = os.path.abspath(os.path.dirname(file_pattern))
     name   = os.path.basename(file_pattern)
-    tmp_folders = ['tmp_uncompressed', 'tmp_redacted', 'tmp_recompressed']
+    tmp_folders = [os.path.join(prefix, e) for e in 
+                    ['tmp_uncompressed', 'tmp_redacted', 'tmp_recompressed']]
     try: 
-        for folder in [os.path.join(prefix, e) for e in tmp_folders]:
+        for folder in tmp_folders:
             os.mkdir(folder)
     except FileExistsError:
         pass
-    p = re.compile(rf'{name}')
-    pdfs_in  = [e.path #re.sub(r'([\(\)])', r'\\\g<1>', e.path) 
-                for e in os.scandir(prefix) if p.search(e.name)]
+    search = re.compile(rf'{name}').search
+    # only the names of the files are matched, and the tmp folders are skipped
+    with os.scandir(prefix) as entries:
+        names = [e.name #re.sub(r'([\(\)])', r'\\\g<1>', e.path) 
+                for e in entries if search(e.name) and e.is_file()]
    # print('Matched these files for processing:')
-   # for e in pdfs_in:
+   # for e in names:
    #     print(e)
 
-    pdfs_unc = [os.path.join(prefix, 'tmp_uncompressed', os.path.basename(e)) for e in pdfs_in]
-    pdfs_red = [os.path.join(prefix, 'tmp_redacted', os.path.basename(e)) for e in pdfs_in]
-    pdfs_cmp = [os.path.join(prefix, 'tmp_recompressed', os.path.basename(e)) for e in pdfs_in]
+    pdfs_in, pdfs_unc, pdfs_red, pdfs_cmp = \
+        [[os.path.join(folder, e) for e in names] 
+            for folder in [prefix, *tmp_folders]]
     
     return pdfs_in, pdfs_unc, pdfs_red, pdfs_cmp
 
@@ -104,20 +114,61 @@ def press_pdfs(pdfs_in, pdfs_out, method, prog, parallel=False):
     if method not in ['compress', 'decompress']:
         raise ValueError('Invalid compression choice: expected either'
                         ' \'compress\' or \'decompress\'')
-    commands = [PDF_PROGRAMS[prog][method](e, pdfs_out[i]).split() 
-                for i, e in enumerate(pdfs_in)]
+    # resolve the executable once instead of searching $PATH per subprocess
+    exe = shutil.which(prog)
+    if exe is None:
+        raise FileNotFoundError(f'Check that {prog} is installed')
+    # a generator so that the first subprocess starts before the last
+    # command is built
+    commands = ([exe, *PDF_PROGRAMS[prog][method](e, o).split()[1:]]
+                for e, o in zip(pdfs_in, pdfs_out))
     if parallel:
-        with Pool() as pool:
-            try:
-                pool.map(subprocess.run, commands)
-            except FileNotFoundError as f:
-                raise FileNotFoundError(f'{f}: Check that {prog} is installed')
+        # the work is done by the external programs, so threads which wait on
+        # them are enough, without starting a python process for each one
+        with ThreadPool(os.cpu_count()) as pool:
+            # imap consumes commands lazily, unlike map
+            for _ in pool.imap(subprocess.run, commands, chunksize=1):
+                pass
     else:
+        for command in commands:
+            subprocess.run(command)
+
+    return
+
+
+def advise_pdfs(pdfs, advice):
+    '''
+    Give the kernel an access pattern hint for each pdf, where advice is
+    the suffix of an os.POSIX_FADV_* constant, e.g. 'DONTNEED'
+    Only hints about the cached pages of the file work here, since the hint is
+    given on a descriptor which is closed right away. Hints about reading,
+    like 'SEQUENTIAL', go to the reading file with advise_sequential
+    Does nothing on systems without posix_fadvise
+    '''
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    advice = getattr(os, f'POSIX_FADV_{advice}')
+    for e in pdfs:
+        try:
+            fd = os.open(e, os.O_RDONLY)
+        except FileNotFoundError:
+            continue
         try:
-            for command in commands:
-                subprocess.run(command)
-        except FileNotFoundError as f:
-            raise FileNotFoundError(f'{f}: Check that {prog} is installed')
+            os.posix_fadvise(fd, 0, 0, advice)
+        finally:
+            os.close(fd)
+
+    return
+
+
+def advise_sequential(f):
+    '''
+    Tell the kernel that the open file object f will be read from front to
+    back, so that it reads ahead more
+    Does nothing on systems without posix_fadvise
+    '''
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
 
     return
 
@@ -127,9 +178,8 @@ def merge_pdfs(pdfs_cmp, output, prog):
     Merge together all the compressed, redacted pdfs
     '''
     try:
-        cat_names = (lambda names: ''.join([name+' ' for name in names])[:-1])
-        #print(PDF_PROGRAMS[prog]['merge'](cat_names(pdfs_cmp), output).split())
-        subprocess.run(PDF_PROGRAMS[prog]['merge'](cat_names(pdfs_cmp), output).split())
+        #print(PDF_PROGRAMS[prog]['merge'](' '.join(pdfs_cmp), output).split())
+        subprocess.run(PDF_PROGRAMS[prog]['merge'](' '.join(pdfs_cmp), output).split())
         print(f'files merged and saved to {output}')
     except subprocess.CalledProcessError as e:
         raise UserWarning(e)
@@ -155,11 +205,13 @@ def handle_whiteout(args):
     returns nothing, but prints verbose output
     '''
     patterns, file_unc, file_red, brute_force, verbose, raw = args
-    with open(patterns, 'rb') as p:
-        with open(file_unc, 'rb') as i:
-            with open(file_red, 'wb') as o:
-                whiteout.deleteTextFromPDF(p, i, o, ['c', 'x', 'X'], 
-                        verbose=verbose, brute_force=brute_force, raw=raw)
+    with open(patterns, 'rb') as p, \
+            open(file_unc, 'rb', buffering=IO_BUFFER_SIZE) as i, \
+            open(file_red, 'wb', buffering=IO_BUFFER_SIZE) as o:
+        # the redaction reads the uncompressed pdf from front to back
+        advise_sequential(i)
+        whiteout.deleteTextFromPDF(p, i, o, ['c', 'x', 'X'], 
+                verbose=verbose, brute_force=brute_force, raw=raw)
     return
 
 def handle_whiteout_re(args):
@@ -170,14 +222,30 @@ def handle_whiteout_re(args):
     returns nothing, but prints verbose output
     '''
     patterns, file_unc, file_red, brute_force, verbose, raw = args
-    with open(patterns, 'rb') as p:
-        with open(file_unc, 'rb') as i:
-            with open(file_red, 'wb') as o:
-                whiteout_re.whiteout_pdf_text(p, i, o, ['c', 'x', 'X'], 
-                        verbose=verbose, brute_force=brute_force, raw=raw)
+    with open(patterns, 'rb') as p, \
+            open(file_unc, 'rb', buffering=IO_BUFFER_SIZE) as i, \
+            open(file_red, 'wb', buffering=IO_BUFFER_SIZE) as o:
+        # the redaction reads the uncompressed pdf from front to back
+        advise_sequential(i)
+        whiteout_re.whiteout_pdf_text(p, i, o, ['c', 'x', 'X'], 
+                verbose=verbose, brute_force=brute_force, raw=raw)
     return
 
 
+def try_handler(job):
+    '''
+    Runs handler(args) for job = (handler, args) in a pool worker
+    returns the path of the uncompressed pdf and the exception raised by the
+    handler, or None, so that the other pdfs in the pool still run
+    '''
+    handler, args = job
+    try:
+        handler(args)
+    except Exception as e:
+        return args[1], e
+    return args[1], None
+
+
 def handle_action(action, patterns, pdfs_unc, pdfs_red, parallel=False,
         brute_force=False, verbose=False, raw=False):
     '''
@@ -188,18 +256,22 @@ def handle_action(action, patterns, pdfs_unc, pdfs_red, parallel=False,
     pdfs_unc: a list of paths of pdfs to transform
     pdfs_red: a list of path of pdfs to write to
     '''
+    handler = ACTIONS[action]
+    # the arguments of each pdf are made as they are handed out
+    args = zip(repeat(patterns), pdfs_unc, pdfs_red, repeat(brute_force),
+                repeat(verbose), repeat(raw))
     if parallel:
         with Pool() as pool:
-            try:
-                pool.map(ACTIONS[action], 
-                        [(patterns, e, pdfs_red[i], brute_force, verbose, raw) 
-                            for i,e in enumerate(pdfs_unc)])
-            except BaseException as e:
-                print(f'Warning: {e}')
+            # each pdf is a large task, so they are sent one at a time to
+            # balance the load, and in the order they are finished.
+            # An error in one pdf is reported without stopping the others
+            for file_unc, e in pool.imap_unordered(try_handler, 
+                    zip(repeat(handler), args), chunksize=1):
+                if e is not None:
+                    print(f'Warning: {file_unc}: {e}')
     else:
-        for i,e in enumerate(pdfs_unc):
-            ACTIONS[action]([patterns, e, pdfs_red[i], brute_force, verbose,
-                raw])
+        for e in args:
+            handler(e)
     return
 
 
@@ -214,6 +286,8 @@ def autoredact(action, prog, patterns, file_pattern, output, parallel=False,
     press_pdfs(pdfs_in, pdfs_unc, 'decompress', prog, parallel)
     # do the redaction here by calling redact with multiprocessing.Pool()
     handle_action(action, patterns, pdfs_unc, pdfs_red, parallel, brute_force, verbose, raw)
+    # the uncompressed pdfs are no longer needed in the page cache
+    advise_pdfs(pdfs_unc, 'DONTNEED')
     # wrap up pdfs
     press_pdfs(pdfs_red, pdfs_cmp, 'compress', prog, parallel)
     merge_pdfs(pdfs_cmp, output, prog)
@@ -16,6 +16,7 @@ The representation of the pdf in terms of classes simply serves
 for convenience while rewriting the pdf.
 '''
 
+import re
 import logging
 import argparse 
 
@@ -51,19 +52,37 @@ LOG_LEVELS = {
         4: logging.DEBUG,
         }
 
+# list of standard pdf compression filters from
+# the pdf 1.7 reference, table 3.5
+PDF_FILTERS = re.compile(b'|'.join([
+        b'FlateDecode', b'ASCIIHexDecode', 
+        b'ASCII85Decode',b'LZWDecode', 
+        b'RunLengthDecode', b'CCITTFaxDecode',
+        b'JBIG2Decode', b'DCTDecode',
+        b'JPXDecode', b'Crypt'
+        ]))
+# one less than the length of the longest filter name
+FILTERS_OVERLAP = len(b'RunLengthDecode') - 1
+# number of bytes to read at a time when scanning a pdf
+CHUNK_SIZE = 1 << 20
+
 
 # start with error handling
 def assert_conditions_pdf(pdf_file_obj):
     '''
     Makes a variety of assertions about the pdf file
     before allowing it to be read.
-    It accepts a file object and reads through it line
-    by line, making assertions for each line
+    It accepts a file object and reads through it in
+    large chunks, making assertions for each chunk
     '''
-
-    for line in pdf_file_obj:
-        assert_uncompressed_pdf(line)
+    # keep the tail of the previous chunk so that a filter name split
+    # across two chunks is still found
+    overlap = b''
+    for chunk in iter(lambda: pdf_file_obj.read(CHUNK_SIZE), b''):
+        chunk = overlap + chunk
+        assert_uncompressed_pdf(chunk)
         # add more assertion statements here
+        overlap = chunk[-FILTERS_OVERLAP:]
     return
 
 def assert_uncompressed_pdf(pdf_line):
@@ -74,18 +93,7 @@ def assert_uncompressed_pdf(pdf_line):
     uncompressed.
     '''
     try:
-        # list of standard pdf compression filters from
-        # the pdf 1.7 reference, table 3.5
-        filters = [ b'FlateDecode', b'ASCIIHexDecode', 
-                    b'ASCII85Decode',b'LZWDecode', 
-                    b'RunLengthDecode', b'CCITTFaxDecode',
-                    b'JBIG2Decode', b'DCTDecode',
-                    b'JPXDecode', b'Crypt'
-                    ]
-
-        for filter in filters:
-            p = re.compile(filter)
-            assert not bool(p.search(pdf_line))
+        assert not bool(PDF_FILTERS.search(pdf_line))
     except AssertionError as e:
         raise AssertionError(f'{e}: this script requires an uncompressed pdf')
 
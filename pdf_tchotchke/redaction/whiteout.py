@@ -11,88 +11,640 @@ and then tries identifying the text in
 various encodings.
 '''
 
-import os 
 import re 
 import argparse
+from io import BytesIO
+from bisect import bisect_right
+from functools import lru_cache
+from operator import le, lt, not_
+from itertools import accumulate, compress, islice
+from multiprocessing import Pool, current_process
 
 import pdftotext
 
 from pdf_tchotchke.utils import filenames 
 
 # Global variables
+# The integer encodings of every possible byte, so that encoding a byte-string
+# is a lookup per byte instead of formatting each one
+INT_TABLES = {
+        f : [bytes(f'{e:{f}}', 'utf-8') for e in range(256)] for f in 'Xxdob'
+        }
+
+def encodeHex(s, fmt):
+    '''
+    Encodes a byte-string in hex like the 'x' or 'X' format specifications.
+    These don't pad bytes below 0x10 with a zero, so bytes.hex() is only used
+    when every byte has two hex digits
+    '''
+    if not s or min(s) >= 0x10:
+        return s.hex().encode('ascii') if fmt == 'x' \
+                else s.hex().upper().encode('ascii')
+    table = INT_TABLES[fmt]
+    return b''.join([table[e] for e in s])
+
 # Define available encodings of byte-strings with format specification mini-language
 INT_ENCODINGS = {
-        'c' : (lambda s : b''.join(bytes(f'{e:c}', 'utf-8') for e in s)), #Character unicode (default)
-        'X' : (lambda s : b''.join(bytes(f'{e:X}', 'utf-8') for e in s)), #Hex capitalized
-        'x' : (lambda s : b''.join(bytes(f'{e:x}', 'utf-8') for e in s)), #Hex uncapitalized
-        'd' : (lambda s : b''.join(bytes(f'{e:d}', 'utf-8') for e in s)), #Decimal
-        'o' : (lambda s : b''.join(bytes(f'{e:o}', 'utf-8') for e in s)), #Octal
-        'b' : (lambda s : b''.join(bytes(f'{e:b}', 'utf-8') for e in s)) #Binary
+        'c' : (lambda s : bytes(s) if s.isascii() 
+                            else s.decode('latin-1').encode('utf-8')), #Character unicode (default)
+        'X' : (lambda s : encodeHex(s, 'X')), #Hex capitalized
+        'x' : (lambda s : encodeHex(s, 'x')), #Hex uncapitalized
+        'd' : (lambda s, t=INT_TABLES['d'] : b''.join([t[e] for e in s])), #Decimal
+        'o' : (lambda s, t=INT_TABLES['o'] : b''.join([t[e] for e in s])), #Octal
+        'b' : (lambda s, t=INT_TABLES['b'] : b''.join([t[e] for e in s])) #Binary
         }
 
+# A line showing a string with the Tj operator
+TEXT_LINE = re.compile(rb'^([\(<])(.*)([\)>] *Tj)$')
+# Whether some lines contain a string shown with the Tj operator
+EXISTS_TEXT = re.compile(rb'[\(<].*?[\)>] *?Tj')
+# The arguments of searchRangeDiff shared with the Pool workers
+SEARCH_RANGE_ARGS = ()
+# Number of lines of a file to search for environments at once
+ENV_CHUNK_LINES = 1 << 16
+# Number of bytes to collect before each write to an output file
+WRITE_BATCH_SIZE = 1 << 20
+# Characters with a special meaning in a python regexp
+RE_SPECIAL = re.compile(rb'[.^$*+?{}\[\]\\|()]')
+# A quantified group containing a quantifier, e.g. rb'(a+)+', which can make a
+# regexp backtrack for exponential time on a line it doesn't match
+NESTED_QUANTIFIER = re.compile(rb'\((?:[^()\\]|\\.)*[*+}](?:[^()\\]|\\.)*\)[*+{]')
+# A reference to a group by number or name, e.g. rb'(a)\1', which refers to
+# another group once the pattern is combined with others in an alternation
+BACKREF = re.compile(rb'\\[1-9]|\(\?P=|\(\?\(')
+
 # Begin text manipulations
-def findEnvAndMatchRanges(og_file, text_patterns, formats, beg_env, end_env):
+def isObjLabel(line, gen=None):
     '''
-    Searches for environments (including nested ones) and returns ranges of their indices in the file.
-    If any of those environments contains a match with any of the patterns in any of the formats, these ranges are returned separately so they can be deleted.
-    Also returns a dictionary with some results about how many matches were made in which formats.
+    Tests whether a line starts with an indirect object label 'N M obj'.
+    Equivalent to re.match(rb'\d+ \d+ obj', line), or to 
+    re.match(rb'\d+ 0 obj', line) if gen=b'0', without running a regexp
+    '''
+    i = line.find(b' ')
+    if i < 1 or not line[:i].isdigit():
+        return False
+    j = line.find(b' ', i+1)
+    if j < i+2 or not line[i+1:j].isdigit():
+        return False
+    if gen is not None and line[i+1:j] != gen:
+        return False
+    return line.startswith(b'obj', j+1)
+
+
+def envMatcher(env):
+    '''
+    Returns a function which tests whether a line matches the env regexp.
+    Patterns anchored to the start of a line which are otherwise literal, 
+    such as rb'^endobj', and the object labels rb'^\d+ 0 obj' and 
+    rb'^\d+ \d+ obj' are tested without the regexp engine
+    '''
+    if env == rb'^\d+ \d+ obj':
+        return isObjLabel
+    elif env == rb'^\d+ 0 obj':
+        return (lambda line: isObjLabel(line, gen=b'0'))
+    elif isLiteralEnv(env):
+        literal = env[1:]
+        return (lambda line: line.startswith(literal))
+    else:
+        return re.compile(env).search
+
+
+def isLiteralEnv(env):
+    '''
+    Tests whether an env is a literal string anchored at the start of a line
+    '''
+    return env.startswith(b'^') and not RE_SPECIAL.search(env[1:])
+
+
+def isFastEnv(env):
+    '''
+    Tests whether envMatcher tests an env without a regexp
+    '''
+    return env in [rb'^\d+ \d+ obj', rb'^\d+ 0 obj'] or isLiteralEnv(env)
+
+
+def boundsMatcher(beg_env, end_env):
+    '''
+    Returns a function which tests whether a line could match either of the
+    beg_env or end_env regexps, so that the many lines which match neither
+    are rejected with a single search. 
+    Returns None if both are tested without a regexp by envMatcher or if they
+    can't be combined into one regexp
+    '''
+    if all(isFastEnv(e) for e in [beg_env, end_env]):
+        return None
+    try:
+        return re.compile(b''.join([b'(?:', beg_env, b')|(?:', end_env, b')'])
+                            ).search
+    except re.error:
+        return None
+
+
+def envsExclusive(beg_env, end_env):
+    '''
+    Tests whether no line can match both of two fast envs (see isFastEnv),
+    e.g. rb'^\d+ 0 obj' and rb'^endobj', since the object labels start with a
+    digit and the literal envs start with their literal string
+    '''
+    literals = [e[1:] for e in [beg_env, end_env] if isLiteralEnv(e)]
+    if len(literals) == 2:
+        return all(literals) and not (literals[0].startswith(literals[1])
+                                    or literals[1].startswith(literals[0]))
+    return len(literals) == 1 and literals[0][:1] not in b'0123456789'
+
+
+@lru_cache(maxsize=32)
+def compileEnvs(beg_env, end_env):
+    '''
+    Returns the functions testing a line for beg_env, end_env and either of
+    them (see envMatcher and boundsMatcher), and if both envs are fast (see
+    isFastEnv) a regexp finding both in many lines at once with groups 'b'
+    and 'e' instead of the third function.
+    Also returns whether a line can't match both envs (see envsExclusive)
+    These are cached since the envs are the same for every file
+    '''
+    is_beg = envMatcher(beg_env)
+    is_end = envMatcher(end_env)
+    # when the envs are tested without a regexp, they can only match at the
+    # start of a line, so they can be found in a whole chunk of the file at
+    # once
+    if all(isFastEnv(e) for e in [beg_env, end_env]):
+        return is_beg, is_end, None, re.compile(b''.join([
+                    b'(?m)(?P<b>', beg_env, b')|(?P<e>', end_env, b')'])), \
+                envsExclusive(beg_env, end_env)
+    return is_beg, is_end, boundsMatcher(beg_env, end_env), None, False
+
+
+@lru_cache(maxsize=32)
+def compilePatterns(text_patterns, formats):
+    '''
+    Returns a regexp matching any of the text_patterns in any of the formats,
+    or None if there are none or they can't be combined, the set of the
+    encoded patterns if they are all literal strings, or None otherwise, and
+    a list of tuples (format, pattern, regexp) of each pattern in each format
+    text_patterns and formats are tuples so that the result can be cached
+    '''
+    # these are all the utf-8 and numerically encoded search patterns
+    # the patterns are read in as strings but they need to be in bytes to match
+    # inside the pdfs
+    each_pattern = [(f, p, re.compile(INT_ENCODINGS[f](p)))
+                        for f in formats for p in text_patterns]
+    # All the patterns in every format are combined into one alternation so
+    # that each line is searched only once, unless they have backreferences,
+    # which would compile but point at the wrong groups
+    try:
+        all_patterns = re.compile(b'|'.join(
+                        b''.join([b'(?P<', f.encode(), str(k).encode(), b'>',
+                            INT_ENCODINGS[f](p), b')'])
+                        for f in formats for k, p in enumerate(text_patterns))
+                    ) if each_pattern and not any(BACKREF.search(e.pattern) 
+                            for _, _, e in each_pattern) else None
+    except re.error:
+        # e.g. the patterns have inline flags or define the same group names,
+        # so they are searched one by one
+        all_patterns = None
+    # we can infer the format and the pattern from the name of the group 
+    # that matched
+
+    # python's regexps backtrack, so a pattern with nested quantifiers can
+    # stall the search on a long line
+    for p in text_patterns:
+        if NESTED_QUANTIFIER.search(p):
+            print(f'whiteout.py Warning: The pattern {p} has nested quantifiers: The search may be very slow')
+
+    # the lines containing patterns that are literal strings can be found
+    # with bytes.find, and only those lines need a search
+    literals = frozenset(INT_ENCODINGS[f](p) 
+                    for f in formats for p in text_patterns)
+    # an empty pattern matches every line anyway
+    if b'' in literals or any(RE_SPECIAL.search(e) for e in literals):
+        literals = None
+    return all_patterns, literals, each_pattern
+
+
+@lru_cache(maxsize=32)
+def compileTextPatterns(text_patterns, raw=False):
+    '''
+    Returns a list of the text_patterns compiled as regexps for strings, to
+    search the output of pdftotext. With raw, the whitespace is removed.
+    text_patterns is a tuple so that the result can be cached, like
+    compilePatterns, and the patterns are compiled once for every file
+    '''
+    if raw:
+        return [re.compile(''.join(e.decode('utf-8').split())) for e in text_patterns]
+    return [re.compile(e.decode('utf-8')) for e in text_patterns]
+
+
+def iterEnvBlocks(og_file, text_patterns, formats, beg_env, end_env,
+        match_results):
+    '''
+    Reads the file in chunks of lines and groups the lines into blocks such
+    that every environment (including nested ones) lies within a single block.
+    Lines outside of any environment are grouped into blocks between them.
+    Yields tuples (start, lines, matched_envs, unmatched_envs) where start is
+    the index of the first line of the block in the file and the envs are
+    ranges of the indices in the file of the environments in that block.
+    The matches made are counted in match_results, which is grouped by format.
     '''
     
-    def searchLine(line, all_patterns, match_results):
+    def searchLine(line, all_patterns, counts):
         '''
         does the search for a line in all the patterns and documents which did it
         '''
-        for j, format_group in enumerate(all_patterns):
-            for k, pattern in enumerate(format_group):
-                if bool(pattern.search(line)):
-                    match_results[formats[j]][text_patterns[k]] += 1
-                    return True
+        if all_patterns:
+            m = all_patterns.search(line)
+            if m:
+                # the outermost group is the last one to close
+                counts[m.lastindex] += 1
+                return True
+            return False
+        # the patterns which can't be combined are counted by their position
+        # (without patterns there is nothing to search for)
+        for g, (_, _, pattern) in enumerate(each_pattern, 1):
+            if pattern.search(line):
+                counts[g] += 1
+                return True
         return False
 
+    is_beg, is_end, is_bound, bounds_re, exclusive = compileEnvs(beg_env,
+                                                        end_env)
+    all_patterns, literals, each_pattern = compilePatterns(
+                                tuple(text_patterns), tuple(formats))
+    # count the matches by the number of the group that matched and only add
+    # them to match_results at the end, instead of two dict lookups per match
+    counts = [0] * (all_patterns.groups + 1 if all_patterns 
+                        else len(each_pattern) + 1)
+
+    # initialize the current block
+    block_start = 0
+    block = []
+    matched_envs = []
+    unmatched_envs = []
+    # initialize search caches: a stack of the beginnings of the open
+    # environments and whether each of them has a match
+    beg_indices = []
+    beg_matched = bytearray()
+    # count the endings without a beginning
+    stray_ends = 0
+
+    og_iter = iter(og_file)
+    offset = 0
+    for chunk in iter(lambda: list(islice(og_iter, ENV_CHUNK_LINES)), []):
+        n = len(chunk)
+        if bounds_re is not None or literals is not None:
+            buf = b''.join(chunk)
+            # the offsets in buf of the start of each line
+            starts = [0, *accumulate(map(len, chunk))]
+        # find the lines where an env begins or ends. Otherwise the lines are
+        # tested by mapping the compiled searches over the chunk, which runs
+        # without a python loop. Only the candidates of a combined search are
+        # tested again for each env
+        if bounds_re is not None:
+            begs = set()
+            ends = set()
+            for m in bounds_re.finditer(buf):
+                j = bisect_right(starts, m.start()) - 1
+                # a line matching both envs is found as a beginning
+                (begs if m.lastgroup == 'b' else ends).add(j)
+            # so the beginnings are tested again for an ending, unless
+            # no line can match both
+            if not exclusive:
+                ends.update(j for j in begs if is_end(chunk[j]))
+        elif is_bound is None:
+            begs = set(compress(range(n), map(is_beg, chunk)))
+            ends = set(compress(range(n), map(is_end, chunk)))
+        else:
+            at_bound = list(compress(range(n), map(is_bound, chunk)))
+            begs = {j for j in at_bound if is_beg(chunk[j])}
+            ends = {j for j in at_bound if is_end(chunk[j])}
+        # find the lines with a match in the same way
+        if literals is not None:
+            hits = set()
+            for literal in literals:
+                k = buf.find(literal)
+                while -1 < k < len(buf):
+                    j = bisect_right(starts, k) - 1
+                    hits.add(j)
+                    k = buf.find(literal, starts[j+1])
+        elif all_patterns:
+            hits = set(compress(range(n), map(all_patterns.search, chunk)))
+        else:
+            hits = set()
+            for _, _, pattern in each_pattern:
+                hits.update(compress(range(n), map(pattern.search, chunk)))
+        # the chunk's events as flat sorted arrays of the beginnings and
+        # endings, with the environment left open by the previous chunk
+        b = sorted(begs)
+        e = sorted(ends)
+        if len(beg_indices) == 1:
+            b.insert(0, beg_indices[0] - offset)
+        # when the environments aren't nested (the usual case of objects),
+        # the beginnings and endings alternate and the k-th environment is
+        # range(b[k], e[k]+1), so they are paired without visiting each line
+        if len(beg_indices) <= 1 and len(e) <= len(b) <= len(e) + 1 \
+                and all(map(le, b, e)) and all(map(lt, e, islice(b, 1, None))):
+            closed = len(e)
+            is_matched = bytearray(len(b))
+            if beg_indices:
+                is_matched[0] = beg_matched[0]
+            for j in hits:
+                k = bisect_right(b, j) - 1
+                if k >= 0 and (k == closed or j <= e[k]) \
+                        and searchLine(chunk[j], all_patterns, counts):
+                    is_matched[k] = 1
+            envs = list(map(range, map(offset.__add__, b[:closed]),
+                                    map((offset+1).__add__, e)))
+            matched_envs += compress(envs, is_matched[:closed])
+            unmatched_envs += compress(envs, map(not_, is_matched[:closed]))
+            beg_indices.clear()
+            beg_matched.clear()
+            if closed < len(b):
+                # the last environment is still open
+                beg_indices.append(offset + b[-1])
+                beg_matched.append(is_matched[-1])
+                pos = closed and e[-1] + 1
+            else:
+                pos = n
+            if pos:
+                block += chunk[:pos]
+                yield block_start, block, matched_envs, unmatched_envs
+                block_start = offset + pos
+                block = []
+                matched_envs = []
+                unmatched_envs = []
+            block += chunk[pos:]
+            offset += n
+            continue
+        # otherwise only visit the lines which can change the state of the
+        # search. The lines in between are added to the block by slicing
+        pos = 0
+        for j in sorted(begs.union(ends, hits)):
+            line = chunk[j]
+            i = offset + j
+            at_beg = j in begs
+            at_end = j in ends
+            if at_beg:
+                beg_indices.append(i)
+                beg_matched.append(False)
+            if beg_indices:
+                if j in hits and searchLine(line, all_patterns, counts):
+                    beg_matched[-1] = True
+                if at_end:
+                    # the ending closes the innermost open environment
+                    env = range(beg_indices.pop(), i+1)
+                    (matched_envs if beg_matched.pop()
+                        else unmatched_envs).append(env)
+            elif at_end:
+                stray_ends += 1
+            if not beg_indices:
+                # no environment is open so the block is complete
+                block += chunk[pos : j+1]
+                yield block_start, block, matched_envs, unmatched_envs
+                pos = j + 1
+                block_start = offset + pos
+                block = []
+                matched_envs = []
+                unmatched_envs = []
+        block += chunk[pos:]
+        offset += len(chunk)
+    # the name of each outermost group is the format and the pattern's index
+    # (the patterns may have named groups of their own, which are skipped)
+    if all_patterns:
+        for f in formats:
+            for k, p in enumerate(text_patterns):
+                match_results[f][p] += counts[all_patterns.groupindex[f'{f}{k}']]
+    else:
+        for g, (f, p, _) in enumerate(each_pattern, 1):
+            match_results[f][p] += counts[g]
+    if block:
+        yield block_start, block, matched_envs, unmatched_envs
+    if beg_indices or stray_ends:
+        print('whiteout.py Warning: Environment beginnings and endings are mismatched: The input file may be damaged')
+
+
+def findEnvAndMatchRanges(og_file, text_patterns, formats, beg_env, end_env):
+    '''
+    Searches for environments (including nested ones) and returns ranges of their indices in the file.
+    If any of those environments contains a match with any of the patterns in any of the formats, these ranges are returned separately so they can be deleted.
+    Also returns a dictionary with some results about how many matches were made in which formats.
+    '''
     # remove duplicates
-    formats = list(set(formats))
-    # these are all the utf-8 and numerically encoded search patterns grouped by format
-    beg_pattern = re.compile(beg_env)
-    end_pattern = re.compile(end_env)
-    # the patterns are read in as strings but they need to be in bytes to match
-    # inside the pdfs
-    all_patterns = [[re.compile(INT_ENCODINGS[f](p)) 
-                        for p in text_patterns] for f in formats ]
-    # we can infer the format based on the index of the group of the matched element in this list
+    formats = list(dict.fromkeys(formats))
+    # initialize lists of ranges to return
+    matched_envs = []
+    unmatched_envs = []
+    # initialize dictionary to count all matches made, grouped by format
+    match_results = { e : { p : 0 for p in text_patterns} for e in formats }
+
+    for _, _, matched, unmatched in iterEnvBlocks(og_file, text_patterns,
+                                    formats, beg_env, end_env, match_results):
+        matched_envs += matched
+        unmatched_envs += unmatched
+
+    return matched_envs, unmatched_envs, match_results
 
+
+def streamEditEnvs(og_file, output_file, text_patterns, formats, beg_env,
+        end_env, edit, keep_nested=False):
+    '''
+    Does the same search as findEnvAndMatchRanges but writes the file to
+    output_file in the same pass, replacing each line in a matched environment
+    with edit(line). Each block of lines is written as soon as all of the
+    environments in it are closed, so the file is only read once.
+    Arguments:
+    og_file: an iterable of the lines of the file, e.g. a file object
+    output_file: a writeable file object in bytes mode
+    edit: a function taking a line and returning the line to write instead
+    keep_nested: Boolean: If True don't edit unmatched envs inside matched ones
+    Returns the same as findEnvAndMatchRanges
+    '''
+    # remove duplicates
+    formats = list(dict.fromkeys(formats))
     # initialize lists of ranges to return
     matched_envs = []
     unmatched_envs = []
     # initialize dictionary to count all matches made, grouped by format
     match_results = { e : { p : 0 for p in text_patterns} for e in formats }
-    # initialize search caches
-    beg_env_indices = []
-    end_env_indices = []
-
-    for i, line in enumerate(og_file):
-        if bool(re.search(beg_pattern, line)):
-            beg_env_indices.append([i, False])
-        if bool(re.search(end_pattern, line)):
-            end_env_indices.append(i)
-        if bool(beg_env_indices):
-            is_match = searchLine(line, all_patterns, match_results)
-            if is_match:
-                beg_env_indices[-1][1] = is_match
-        if bool(beg_env_indices) and bool(end_env_indices):
-            beg_index, beg_bool = beg_env_indices.pop()
-            end_index = end_env_indices.pop()
-            if beg_bool:
-                matched_envs.append(range(  
-                        beg_index, end_index+1))
-            else:
-                unmatched_envs.append(range(    
-                        beg_index, end_index+1))
-    if bool(beg_env_indices) or bool(end_env_indices):
-        print('whiteout.py Warning: Environment beginnings and endings are mismatched: The input file may be damaged')
+
+    def editLines():
+        '''
+        yields the runs of lines to write, block by block
+        '''
+        for start, lines, matched, unmatched in iterEnvBlocks(og_file,
+                text_patterns, formats, beg_env, end_env, match_results):
+            matched_envs.extend(matched)
+            unmatched_envs.extend(unmatched)
+            if not bool(matched):
+                yield b''.join(lines)
+                continue
+            # the indices of the lines relative to the start of the block
+            is_edited = flagRanges(
+                    [range(r.start-start, r.stop-start) for r in matched],
+                    len(lines))
+            if keep_nested:
+                # don't edit the unmatched envs
+                for r in unmatched:
+                    is_edited[r.start-start : r.stop-start] = bytes(len(r))
+            # yield the runs of unedited lines joined together
+            i = 0
+            while i < len(lines):
+                j = is_edited.find(1, i)
+                if j == -1:
+                    j = len(lines)
+                k = is_edited.find(0, j)
+                if k == -1:
+                    k = len(lines)
+                yield b''.join(lines[i:j])
+                yield b''.join([edit(e) for e in lines[j:k]])
+                i = k
+
+    writeBatched(output_file, editLines())
 
     return matched_envs, unmatched_envs, match_results
 
 
+def writeBatched(output_file, lines, batch_size=WRITE_BATCH_SIZE):
+    '''
+    Writes an iterable of lines (or runs of lines) to output_file, joining
+    them into batches of about batch_size bytes so that there is one write
+    per batch, not per line. Runs longer than batch_size are written as they
+    are, without copying them into a batch
+    '''
+    batch = []
+    size = 0
+    for line in lines:
+        if len(line) >= batch_size:
+            if batch:
+                output_file.write(b''.join(batch))
+                batch.clear()
+                size = 0
+            output_file.write(line)
+            continue
+        batch.append(line)
+        size += len(line)
+        if size >= batch_size:
+            output_file.write(b''.join(batch))
+            batch.clear()
+            size = 0
+    if batch:
+        output_file.write(b''.join(batch))
+    return
+
+
+def writeEdited(output_file, og_bytes, og_file, is_edited, edit):
+    '''
+    Writes og_bytes to output_file, replacing each line in og_file (the lines
+    of og_bytes) whose flag in is_edited is set with edit(line). 
+    The lines between the edited ones are written as slices of og_bytes, and
+    the short runs are batched together (see writeBatched)
+    '''
+    starts = [0, *accumulate(map(len, og_file))]
+
+    def editRuns(view):
+        '''
+        yields the alternating runs of unedited and edited lines
+        '''
+        i = 0
+        while i < len(og_file):
+            # find the next run of edited lines
+            j = is_edited.find(1, i, len(og_file))
+            if j == -1:
+                j = len(og_file)
+            k = is_edited.find(0, j, len(og_file))
+            if k == -1:
+                k = len(og_file)
+            yield view[starts[i] : starts[j]]
+            yield b''.join([edit(e) for e in og_file[j:k]])
+            i = k
+
+    with memoryview(og_bytes) as view:
+        writeBatched(output_file, editRuns(view))
+    return
+
+
+def searchRangeDiff(rng, og_bytes, starts, patterns, og_pages, og_counts,
+        raw=False):
+    '''
+    Whites out the text in rng and runs pdftotext on the edited pdf
+    Returns the index of the first pattern with fewer instances in some page
+    than in the original text, or None if there is no such pattern
+    Arguments:
+    rng: the range of lines in the pdf to whiteout
+    og_bytes: the pdf as one byte string
+    starts: the offset in og_bytes of the start of each line, and its length
+    patterns: a list of compiled re patterns from text_patterns (not bytes)
+    og_pages: the original text of each page
+    og_counts: for each page, the number of instances of each pattern in the
+        original text
+    raw: whether to use pdftotext raw
+    '''
+    # only the lines in rng are edited, the rest is copied in two slices
+    beg, end = starts[rng.start], starts[rng.stop]
+    with memoryview(og_bytes) as view:
+        new_bytes = b''.join([view[:beg], 
+                        *[replacePDFTextWithSpace(e) 
+                            for e in BytesIO(view[beg:end]).readlines()],
+                        view[end:]])
+    # the edited pdf is kept in memory for pdftotext to read. A BytesIO
+    # shares the buffer of its initial bytes instead of copying them
+    with BytesIO(new_bytes) as g:
+        try:
+            tmp_text = pdftotext.PDF(g, raw=raw)
+        except pdftotext.Error as e:
+            print(f'Warning: pdftotext.Error: {e}')
+            return None
+    try:
+        # check to see if the new text has at least one fewer instance of the 
+        # search pattern. Only count up to the original number of instances
+        for og_page, page_counts, new_text in zip(og_pages, og_counts,
+                                                    tmp_text):
+            # most pages aren't changed by the edit, and comparing the whole
+            # page is much quicker than counting the patterns in it again
+            if not any(page_counts) or new_text == og_page:
+                continue
+            for i, pattern in enumerate(patterns):
+                if page_counts[i] and page_counts[i] > countMatches(pattern,
+                        new_text, page_counts[i]):
+                    return i
+    except BaseException as e:
+        print(f'Warning: {e}')
+    return None
+
+
+@lru_cache(maxsize=256)
+def isLiteralPattern(pattern):
+    '''
+    Tests whether a regexp for strings matches only its own text
+    '''
+    return not RE_SPECIAL.search(pattern.encode('utf-8'))
+
+
+def countMatches(pattern, text, limit=None):
+    '''
+    Counts the non-overlapping matches of a compiled regexp in text, but only
+    up to limit. Literal patterns are counted in full with str.count instead
+    '''
+    if isLiteralPattern(pattern.pattern):
+        return text.count(pattern.pattern)
+    return sum(1 for _ in islice(pattern.finditer(text), limit))
+
+
+def initSearchRangeDiff(*args):
+    '''
+    Stores the arguments of searchRangeDiff after rng in a Pool worker
+    '''
+    global SEARCH_RANGE_ARGS
+    SEARCH_RANGE_ARGS = args
+    return
+
+
+def searchRangeDiffWorker(rng):
+    '''
+    Calls searchRangeDiff in a Pool worker set up by initSearchRangeDiff
+    '''
+    return searchRangeDiff(rng, *SEARCH_RANGE_ARGS)
+
+
 def findPDFMatchesBruteForce(f, text_patterns, env_matches, og_file=None,
         raw=False):
     '''
@@ -104,93 +656,82 @@ def findPDFMatchesBruteForce(f, text_patterns, env_matches, og_file=None,
     og_file: f.readlines()
     raw: whether to use pdftotext raw
     '''
-    def searchDiff(og_text, new_text, patterns, brute_results):
-        '''
-        Returns True if a match was found and collect data about which pattern was matched
-        Arguments:
-        A string of the original text 
-        A string of the edited text
-        patterns: a list of compiled re patterns from text_patterns (not bytes)
-        brute_results: a dictionary like { 'c' : {e:0 for e in text_patterns}}
-            where text_patterns are strings that were compiled into patterns
-        '''
-        # check to see if the new text has at least one fewer instance of the 
-        # search pattern
-        for i, pattern in enumerate(patterns):
-            if len(pattern.findall(og_text)) > len(pattern.findall(new_text)):
-                brute_results['c'][text_patterns[i]] += 1
-                return True
-        return False
-    
     # initialize search items
     brute_search_matches = []
     brute_search_unmatched = []
     # initialize data collector
     brute_results = { 'c' : { e : 0  for e in text_patterns } }
     # compile re's as strings (output of pdftotext)
-    if raw:
-        patterns = [re.compile(''.join(e.decode('utf-8').split())) for e in text_patterns]
-    else:
-        patterns = [re.compile(e.decode('utf-8')) for e in text_patterns]
+    patterns = compileTextPatterns(tuple(text_patterns), raw)
     
     # Using pdftotext python library to read text
     # all manipulations are done in memory so hopefull this is quick
     # produce original text
-    og_text = pdftotext.PDF(f, raw=raw)
+    og_pages = list(pdftotext.PDF(f, raw=raw))
+    # the original text doesn't change so count the instances of the patterns
+    # in each page only once
+    og_counts = [[countMatches(pattern, page) for pattern in patterns]
+                    for page in og_pages]
     
     # remove text in each range once, one by one, checking for diffs in each page
     if not og_file:
         f.seek(0)
         og_file = f.readlines()
-    tmp_pdf_file = filenames.fileOut(re.sub('.pdf','_tmp_whiteout.pdf',f.name))
-    exists_text = re.compile(rb'[\(<].*?[\)>] *?Tj')
-    for rng in env_matches:
-        with open(tmp_pdf_file, 'w+b') as g:
-            # if the rng has no text objects, skip it
-            if not exists_text.search(b''.join(og_file[rng.start : rng.stop])):
-                brute_search_unmatched.append(rng)
-                continue
-            g.writelines([replacePDFTextWithSpace(e) 
-                            if i in rng else e 
-                            for i, e in enumerate(og_file)])
-            g.seek(0)
-            try:
-                tmp_text = pdftotext.PDF(g, raw=raw)
-            except pdftotext.Error as e:
-                print(f'Warning: pdftotext.Error: {e}')
+    # only the ranges with text objects can change the text, so the others
+    # are never sent to pdftotext
+    has_text = [bool(EXISTS_TEXT.search(
+                        b''.join(og_file[rng.start : rng.stop])))
+                    for rng in env_matches]
+    text_matches = [rng for rng, e in zip(env_matches, has_text) if e]
+    # the workers get the pdf as one byte string, which is much quicker to
+    # send than a list of its lines
+    args = (b''.join(og_file), [0, *accumulate(map(len, og_file))], patterns,
+            og_pages, og_counts, raw)
+    if current_process().daemon or not text_matches:
+        # daemonic processes, e.g. the workers of prepare -P, can't have a Pool
+        hits = map(lambda rng: searchRangeDiff(rng, *args), text_matches)
+        pool = None
+    else:
+        # each range is independent and pdftotext dominates, so use all cores
+        # the pdf is sent once to each worker instead of once per range
+        pool = Pool(initializer=initSearchRangeDiff, initargs=args)
+        hits = pool.imap(searchRangeDiffWorker, text_matches, chunksize=1)
+    try:
+        for rng, e in zip(env_matches, has_text):
+            hit = next(hits) if e else None
+            if hit is None:
                 brute_search_unmatched.append(rng)
                 continue
             try:
-                is_match = False
-                for i, page in enumerate(og_text):
-                    if searchDiff(page, tmp_text[i],
-                                    patterns, brute_results):
-                        brute_search_matches.append(rng)
-                        # Exception case for bad pdfs
-                        if b' ' in new_patterns:
-                            brute_search_unmatched.append(env)
-                            continue 
-                        is_match = True
-                        new_patterns = []
-                        for line in og_file[rng.start : rng.stop]:
-                            m = replacePDFTextWithSpace(line, just_match=True)
-                            if bool(m):
-                                new_patterns.append(m)
-                        new_ranges, _, new_results = findEnvAndMatchRanges(
-                                og_file, new_patterns, ['c'], 
-                                rb'^\d+ \d+ obj', rb'^endobj')
-                        [brute_search_matches.append(env_matches.pop(i))
-                            for i,r in enumerate(env_matches) if r in new_ranges]
-                        brute_results['c'].update(new_results['c'])
-                        break
-                    else:
-                        pass
-                if not is_match:
-                    brute_search_unmatched.append(rng)
+                brute_results['c'][text_patterns[hit]] += 1
+                brute_search_matches.append(rng)
+                # Exception case for bad pdfs
+                if b' ' in new_patterns:
+                    brute_search_unmatched.append(env)
+                    continue 
+                new_patterns = []
+                for line in og_file[rng.start : rng.stop]:
+                    m = replacePDFTextWithSpace(line, just_match=True)
+                    if bool(m):
+                        new_patterns.append(m)
+                new_ranges, _, new_results = findEnvAndMatchRanges(
+                        og_file, new_patterns, ['c'], 
+                        rb'^\d+ \d+ obj', rb'^endobj')
+                [brute_search_matches.append(env_matches.pop(i))
+                    for i,r in enumerate(env_matches) if r in new_ranges]
+                brute_results['c'].update(new_results['c'])
             except BaseException as e:
                 print(f'Warning: {e}')
                 brute_search_unmatched.append(rng)
-    os.remove(tmp_pdf_file)
+    except BaseException:
+        # stop the workers instead of leaving them running
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        raise
+    if pool is not None:
+        pool.close()
+        pool.join()
 
     return (brute_search_matches, brute_search_unmatched, brute_results)
 
@@ -199,8 +740,7 @@ def replacePDFTextWithSpace(line, count_del=None, just_match=False):
     '''
     This replaces the characters in a string with an equivalent number of spaces
     '''
-    p = re.compile(b'^([\(<])(.*)([\)>] *Tj)$')
-    m = p.match(line)
+    m = TEXT_LINE.match(line)
     if just_match:
         if bool(m):
             return m.group(2)
@@ -210,20 +750,37 @@ def replacePDFTextWithSpace(line, count_del=None, just_match=False):
         # adding b' '*len(re.findall(b'\\\\\\\\', match.group('text'))) because sometimes I've seen lines with multiple backslashes and only these lines need an extra space because otherwise the pdf displays an empty box
         if bool(count_del):
             count_del[0] += 1
-        return m.group(1) + b' ' * len(re.findall(b'\\\\\\\\', m.group(2))) \
-                + re.sub(b'.', b' ', m.group(2)) + m.group(3) + b'\n'
+        # the text cannot contain a newline, so every byte becomes a space
+        text = m.group(2)
+        return m.group(1) + b' ' * (text.count(b'\\\\') + len(text)) \
+                + m.group(3) + b'\n'
 
     else:
         return line
 
 
+def flagRanges(ranges, length=0):
+    '''
+    Returns a bytearray of at least the given length which is nonzero at every
+    index contained in one of the ranges and zero elsewhere
+    '''
+    flags = bytearray(max([length] + [rng.stop for rng in ranges]))
+    for rng in ranges:
+        flags[rng.start : rng.stop] = b'\x01' * len(rng)
+    return flags
+
+
 def printSearchDict(results):
     '''
     Prints the search dictionary in an easily readable format
     '''
     # formats are first level and patterns the second but I want to flip this when printing
-    for pattern in results['c']:
-        data = { e : results[e][pattern] for e in results.keys() }
+    # so transpose the dictionary in one pass over it
+    transposed = { pattern : {} for pattern in results['c'] }
+    for e, counts in results.items():
+        for pattern, count in counts.items():
+            transposed[pattern][e] = count
+    for pattern, data in transposed.items():
         total = sum(data.values())
         print(f'Matched {total} times in total with format distribution {data}\n\t{pattern}\n')
     return 
@@ -255,57 +812,56 @@ def deleteTextFromPDF(pattern_file, input_file, output_file, formats,
     formats = [e for e in ['c','X','x'] if e in formats]
     # get the original text patterns to search, and separately those patterns in all requested encodings
     with pattern_file as p:
-        text_patterns = list(set([e.strip() for e in p]))
+        text_patterns = list(dict.fromkeys(e.strip() for e in p))
+    lines_removed = [0]
+    edit = (lambda line: replacePDFTextWithSpace(line, count_del=lines_removed))
     with input_file as f:
-        og_file = f.readlines()
-        search_env_matches, env_matches, search_results = \
-                findEnvAndMatchRanges(
-                        og_file, text_patterns, formats, 
-                        beg_env, end_env)
-        all_matched_indices = set()
-        [all_matched_indices.update(set(rng)) for rng in search_env_matches]
-        all_unmatched_env_indices = set()
-        [all_unmatched_env_indices.update(set(rng)) for rng in env_matches]
-
-        if brute_force:
+        if not brute_force:
+            # the matched environments are known once they are closed so the
+            # edited pdf is written in the same pass as the search
+            with output_file as g:
+                search_env_matches, env_matches, search_results = \
+                        streamEditEnvs(
+                                f, g, text_patterns, formats, 
+                                beg_env, end_env, edit, keep_nested)
+            if show_indices:
+                print('Matched ranges:')
+                print(env_matches)
+                print('Unmatched ranges:')
+                print(search_env_matches)
+
+        else:
+            # read the pdf once, and split it into lines without reading again
+            og_bytes = f.read()
+            og_file = BytesIO(og_bytes).readlines()
+            search_env_matches, env_matches, search_results = \
+                    findEnvAndMatchRanges(
+                            og_file, text_patterns, formats, 
+                            beg_env, end_env)
+            all_matched_indices = flagRanges(search_env_matches, len(og_file))
+
             print(f'Brute Force! {f.name}')
             f.seek(0)
             brute_search_matches, brute_search_unmatched, brute_results =   \
                     findPDFMatchesBruteForce(f, text_patterns, 
                                                 env_matches, og_file, raw)
             # add the indices of the new matches
-            [all_matched_indices.update(set(rng)) for rng in brute_search_matches]
-            # remove the indices of new ranges that were matched
-            final_unmatched_envs = set()
-            [final_unmatched_envs.update(set(rng)) for rng in brute_search_unmatched]
-            all_unmatched_env_indices.intersection(final_unmatched_envs) 
+            for rng in brute_search_matches:
+                all_matched_indices[rng.start : rng.stop] = b'\x01' * len(rng)
+            if keep_nested:
+                # don't edit the unmatched envs
+                for rng in env_matches:
+                    all_matched_indices[rng.start : rng.stop] = bytes(len(rng))
             if show_indices:
                 print('Matched ranges:')
                 print(brute_search_matches)
                 print('Unmatched ranges:')
                 print(brute_search_unmatched)
 
-        elif show_indices:
-            print('Matched ranges:')
-            print(env_matches)
-            print('Unmatched ranges:')
-            print(search_env_matches)
-
-
-        # write the final edited pdf
-        with output_file as g:
-            lines_removed = [0]
-            # omit the matched lines when writing
-            for i, line in enumerate(og_file):
-                if keep_nested:
-                    if i in all_matched_indices and i not in all_unmatched_env_indices:
-                        g.write(replacePDFTextWithSpace(line,
-                            count_del=lines_removed))
-                elif i in all_matched_indices:
-                    g.write(replacePDFTextWithSpace(line,
-                        count_del=lines_removed))
-                else:
-                    g.write(line)
+            # write the final edited pdf
+            with output_file as g:
+                # omit the matched lines when writing
+                writeEdited(g, og_bytes, og_file, all_matched_indices, edit)
 
         if verbose:
             print(f'Generic results: {f.name}')
@@ -335,36 +891,23 @@ def deleteGeneric(pattern_file, input_file, output_file, formats,
     (the bool arguments should be recast with the logging module)
     '''
     with pattern_file as p:
-        text_patterns = [e.strip() for e in p]
+        text_patterns = list(dict.fromkeys(e.strip() for e in p))
+    lines_removed = [0]
+    def edit(line):
+        lines_removed[0] += 1
+        return b''
     with input_file as f:
-        search_env_matches, env_matches, search_results = findEnvAndMatchRanges(
-                f, text_patterns, formats, beg_env, end_env)
-
-        all_matched_indices = set()
-        [all_matched_indices.update(set(rng)) for rng in search_env_matches]
-        all_unmatched_env_indices = set()
-        [all_unmatched_env_indices.update(set(rng)) for rng in env_matches]
-
         with output_file as g:
-            f.seek(0)
-            lines_removed = 0
-            for i, line in enumerate(f):
-                if keep_nested:
-                    if i in all_matched_indices and i not in all_unmatched_env_indices:
-                        lines_removed += 1
-                        continue
-                elif i in all_matched_indices:
-                    lines_removed += 1
-                    continue
-                else:
-                    g.write(line)
+            search_env_matches, env_matches, search_results = streamEditEnvs(
+                    f, g, text_patterns, formats, beg_env, end_env, edit,
+                    keep_nested)
 
         if show_indices:
             print('Matched ranges:')
             print(search_env_matches) # all_matched_indices can be overwhelming
 
         if verbose:
-            print(f'Generic results: {f.name}\n{lines_removed} lines removed')
+            print(f'Generic results: {f.name}\n{lines_removed[0]} lines removed')
             printSearchDict(search_results)
 
     return
@@ -436,7 +979,7 @@ def cli():
             help='enter the name or path to write to')
     parser.add_argument(
             '-f', dest='format', 
-            default=set('c'), type=(lambda x: list(set(['c'] + [e for e in x]))),
+            default=['c'], type=(lambda x: list(dict.fromkeys(['c', *x]))),
             help='Delete integer encodings of the search pattern. Options \'cxXdob\'.' 
                 ' See Python\'s \'Format Specification Mini-Language\'.')
     parser.add_argument(
@@ -14,25 +14,123 @@ parsimoniously and it will not succeed
 in nested structures
 '''
 
-import os 
 import re 
+import os
 import argparse
+from io import BytesIO
+from functools import lru_cache
+from itertools import islice
+from multiprocessing import Pool, current_process
 
 import pdftotext
 
 from pdf_tchotchke.utils import filenames 
 
 # Global variables
+# The hex encodings of every possible byte, so that encoding a byte-string is
+# a lookup per byte instead of formatting each one
+INT_TABLES = { f : [bytes(f'{e:{f}}', 'utf-8') for e in range(256)] for f in 'Xx' }
+
+def encode_hex(s, fmt):
+    '''
+    Encodes a byte-string in hex like the 'x' or 'X' format specifications.
+    These don't pad bytes below 0x10 with a zero, so bytes.hex() is only used
+    when every byte has two hex digits
+    '''
+    if not s or min(s) >= 0x10:
+        return s.hex().encode('ascii') if fmt == 'x' \
+                else s.hex().upper().encode('ascii')
+    table = INT_TABLES[fmt]
+    return b''.join([table[e] for e in s])
+
 # Define available encodings of byte-strings with format specification mini-language
 INT_ENCODINGS = {
-        'c' : (lambda s : b''.join(bytes(f'{e:c}', 'utf-8') for e in s)), #Character unicode (default)
-        'X' : (lambda s : b''.join(bytes(f'{e:X}', 'utf-8') for e in s)), #Hex capitalized
-        'x' : (lambda s : b''.join(bytes(f'{e:x}', 'utf-8') for e in s)) #Hex uncapitalized
+        'c' : (lambda s : bytes(s) if s.isascii()
+                            else s.decode('latin-1').encode('utf-8')), #Character unicode (default)
+        'X' : (lambda s : encode_hex(s, 'X')), #Hex capitalized
+        'x' : (lambda s : encode_hex(s, 'x')) #Hex uncapitalized
         }
 # Define all escape sequences in literal strings in pdfs (table 3.2, pdf1.7ref)
 ESC_SEQS = set([rb'\n', rb'\r', rb'\t', rb'\b', rb'\f', rb'\(', rb'\)', rb'\\\\', rb'\ddd'])
+# The escape sequences which match a single byte are counted together by
+# deleting them with bytes.translate, and the others with one alternation,
+# except rb'\b' which matches an empty string and so can't be combined
+ESC_SEQ_BYTES = b'\n\r\t\f()'
+ESC_SEQ_PATTERNS = [re.compile(rb'\b'), re.compile(rb'\\\\|\ddd')]
+# Maps every byte to a non-breaking space, to white out a string in one pass
+WHITEOUT_TABLE = b'\xA0' * 256
+# Test whether there is a literal or hex string shown with the Tj operator
+TEXT_EXISTS = re.compile(rb'[\(<].*?[\)>] *?Tj')
+# The arguments of text_removed shared with the Pool workers
+TEXT_REMOVED_ARGS = ()
+# A quantified group containing a quantifier, e.g. rb'(a+)+', which can make a
+# regexp backtrack for exponential time on a string it doesn't match
+NESTED_QUANTIFIER = re.compile(rb'\((?:[^()\\]|\\.)*[*+}](?:[^()\\]|\\.)*\)[*+{]')
+# A reference to a group by number or name, e.g. rb'(a)\1', which refers to
+# another group once the pattern is combined with others in an alternation
+BACKREF = re.compile(rb'\\[1-9]|\(\?P=|\(\?\(')
+# Characters with a special meaning in a python regexp for strings
+RE_SPECIAL = re.compile(r'[.^$*+?{}\[\]\\|()]')
+# Whether a regexp looks at the characters before where a search starts
+LOOKS_BEHIND = re.compile(rb'\^|\\[AbB]|\(\?<')
+# Match a literal or hex string shown with the Tj operator
+TEXT_OBJ = re.compile(rb'([\(<])(.*?)([\)>] *?Tj\n)')
 
 # Begin text manipulations
+@lru_cache(maxsize=32)
+def compile_env(env_pattern):
+    '''
+    Compiles the environment pattern, which is the same for every file
+    '''
+    return re.compile(env_pattern, re.DOTALL)
+
+
+@lru_cache(maxsize=32)
+def compile_patterns(text_patterns, formats):
+    '''
+    Compiles the search patterns in every format, as byte strings, the
+    alternation of all of them, and for each format the alternation of its
+    patterns in groups named by their index. An alternation is None if the
+    patterns can't be combined
+    text_patterns and formats are tuples so that the result can be cached
+    '''
+    # python's regexps backtrack, so a pattern with nested quantifiers can
+    # stall the search on a long environment
+    for p in text_patterns:
+        if NESTED_QUANTIFIER.search(p):
+            print(f'Warning: The pattern {p} has nested quantifiers: The search may be very slow')
+    all_patterns = [[re.compile(INT_ENCODINGS[f](p)) 
+                        for p in text_patterns] for f in formats ]
+    # we can infer the format based on the index of the group of the matched 
+    # element in this list
+    # the alternation of all of them matches if any of them does, unless they
+    # have backreferences, which would compile but point at the wrong groups
+    try:
+        any_pattern = None if any(BACKREF.search(p.pattern) 
+                            for format_group in all_patterns 
+                            for p in format_group) \
+            else re.compile(b'|'.join(b''.join([b'(?:', p.pattern, b')'])
+                        for format_group in all_patterns 
+                        for p in format_group))
+    except re.error:
+        # e.g. the patterns define the same group names
+        any_pattern = None
+    format_patterns = []
+    for format_group in all_patterns:
+        # the backreferences would point at the wrong groups once the
+        # patterns are put in named groups, so those are searched one by one
+        if any(BACKREF.search(p.pattern) for p in format_group):
+            format_patterns.append(None)
+            continue
+        try:
+            format_patterns.append(re.compile(b'|'.join(
+                        b''.join([b'(?P<p', str(k).encode(), b'>', p.pattern, 
+                            b')']) for k, p in enumerate(format_group))))
+        except re.error:
+            format_patterns.append(None)
+    return all_patterns, any_pattern, format_patterns
+
+
 def find_env_matches(og_file, text_patterns, formats, env_pattern):
     '''
     Uses re's to find the text patterns contained in the given environment in a
@@ -47,48 +145,152 @@ def find_env_matches(og_file, text_patterns, formats, env_pattern):
     - unmatched_envs: a list of re.match objects matching env but not patterns
     - search results: a dictionary with results about which patterns matched
     '''
-    def patterns_in_str(line, all_patterns, match_results):
+    def patterns_in_env(env, all_patterns, match_results):
         '''
-        Tests to see if any of the search patterns are in the string
+        Tests to see if any of the search patterns are in the environment
         Arguments:
-        - line: a string to search
+        - env: an re.match object of og_file to search
         - all_patterns: a list of lists of compiled re's
         - match_results: a dictionary to add search results info to
         Returns:
         - Boolean: True if matched else False
         '''
+        # one search rejects the envs without any of the patterns, and
+        # only the others are searched in order to find the first pattern
+        if any_pattern is not None:
+            if in_place:
+                # searching og_file between pos and endpos doesn't copy env
+                found = any_pattern.search(og_file, env.start(), env.end())
+            else:
+                found = any_pattern.search(env.group(0))
+            if not found:
+                return False
+        line = env.group(0)
         for j, format_group in enumerate(all_patterns):
-            for k, pattern in enumerate(format_group):
-                if bool(pattern.search(line)):
-                    match_results[formats[j]][text_patterns[k]] += 1
-                    return True
+            first = None
+            if format_patterns[j] is not None:
+                # one search finds whether the format has a match and which
+                # pattern matched first in the line. Only the patterns before
+                # it in the list, which may match further along the line, are
+                # searched again
+                m = format_patterns[j].search(line)
+                if not m:
+                    continue
+                first = int(m.lastgroup[1:])
+            for k, pattern in enumerate(format_group[:first]):
+                if pattern.search(line):
+                    break
+            else:
+                if first is None:
+                    continue
+                k = first
+            match_results[formats[j]][text_patterns[k]] += 1
+            return True
         return False
 
-    # compile the environment pattern
-    env_pattern = re.compile(env_pattern, re.DOTALL)
-    # compile the search patterns for matching, as byte strings
-    all_patterns = [[re.compile(INT_ENCODINGS[f](p)) 
-                        for p in text_patterns] for f in formats ]
-    # we can infer the format based on the index of the group of the matched 
-    # element in this list
+    # compile the environment pattern and the search patterns
+    env_pattern = compile_env(env_pattern)
+    all_patterns, any_pattern, format_patterns = compile_patterns(
+                                    tuple(text_patterns), tuple(formats))
+    # the patterns which look behind their start, e.g. rb'^', can match
+    # differently at pos than at the start of a copy of env
+    in_place = any_pattern is not None \
+                and not LOOKS_BEHIND.search(any_pattern.pattern)
     # initialize lists of matches to return
     matched_envs = []
     unmatched_envs = []
     # initialize dictionary to count all matches made, grouped by format
     match_results = { e : { p : 0 for p in text_patterns} for e in formats }
-    # match only text
-    exists_text = re.compile(rb'[\(<].*?[\)>] *?Tj')
 
     for env in env_pattern.finditer(og_file):
-        if not exists_text.search(og_file[env.start() : env.end()]):
+        # match only text
+        if not TEXT_EXISTS.search(og_file, env.start(), env.end()):
             unmatched_envs.append(env)
-        elif patterns_in_str(env.group(0), all_patterns, match_results):
+        elif patterns_in_env(env, all_patterns, match_results):
             matched_envs.append(env)
         else:
             unmatched_envs.append(env)
     return matched_envs, unmatched_envs, match_results
 
 
+def text_removed(span, og_file, patterns, og_pages, og_counts, raw=False):
+    '''
+    Whites out the text in the span of og_file and runs pdftotext on it
+    Returns a list with, for each page, the index of the first pattern with
+    fewer instances than in the original text, or None if there is none.
+    Returns None if pdftotext fails
+    Arguments:
+    span: a tuple (start, end) of the env to whiteout in og_file
+    og_file: the string that is f.read()
+    patterns: a list of compiled re patterns from text_patterns (not bytes)
+    og_pages: the original text of each page
+    og_counts: for each page, the number of instances of each pattern in the
+        original text
+    raw: whether to use pdftotext raw
+    '''
+    # the edited pdf is kept in memory for pdftotext to read. A BytesIO
+    # shares the buffer of its initial bytes instead of copying them
+    with BytesIO(whiteout_pdf_span(og_file, span)) as g:
+        try:
+            tmp_text = pdftotext.PDF(g, raw=raw)
+        except pdftotext.Error as e:
+            print(f'Warning: pdftotext.Error: {e}')
+            return None
+    page_hits = []
+    try:
+        for i, page_counts in enumerate(og_counts):
+            page_hits.append(None)
+            # an env usually lands on one page, so the others are unchanged
+            # and comparing the whole page is quicker than counting again
+            if not any(page_counts) or tmp_text[i] == og_pages[i]:
+                continue
+            # check to see if the new text has at least one fewer instance of 
+            # the search pattern. Only count up to the original number
+            for j, pattern in enumerate(patterns):
+                if page_counts[j] and page_counts[j] > count_matches(pattern,
+                        tmp_text[i], page_counts[j]):
+                    page_hits[i] = j
+                    break
+    except BaseException as e:
+        print(f'Warning: {e}')
+        return None
+    return page_hits
+
+
+@lru_cache(maxsize=256)
+def is_literal_pattern(pattern):
+    '''
+    Tests whether a regexp for strings matches only its own text
+    '''
+    return not RE_SPECIAL.search(pattern)
+
+
+def count_matches(pattern, text, limit=None):
+    '''
+    Counts the non-overlapping matches of a compiled regexp in text, but only
+    up to limit. Literal patterns are counted in full with str.count instead
+    '''
+    if is_literal_pattern(pattern.pattern):
+        return text.count(pattern.pattern)
+    return sum(1 for _ in islice(pattern.finditer(text), limit))
+
+
+def init_text_removed(*args):
+    '''
+    Stores the arguments of text_removed after span in a Pool worker
+    '''
+    global TEXT_REMOVED_ARGS
+    TEXT_REMOVED_ARGS = args
+    return
+
+
+def text_removed_worker(span):
+    '''
+    Calls text_removed in a Pool worker set up by init_text_removed
+    '''
+    return text_removed(span, *TEXT_REMOVED_ARGS)
+
+
 def find_matches_pdftotext(f, text_patterns, envs, og_file=None, raw=False):
     '''
     This processes the environments which weren't already matched by deleting them from the file, running pdftotext to see the difference with the original, 
@@ -98,24 +300,6 @@ def find_matches_pdftotext(f, text_patterns, envs, og_file=None, raw=False):
     envs: a list of re.match objects of the env_pattern to test in f
     og_file: the string that is f.read(), optional
     '''
-    def patterns_removed_pdftotext(og_text, new_text, patterns, brute_results):
-        '''
-        Returns True if a match was found and collect data about which pattern was matched
-        Arguments:
-        A string of the original text 
-        A string of the edited text
-        patterns: a list of compiled re patterns from text_patterns (not bytes)
-        brute_results: a dictionary like { 'c' : {e:0 for e in text_patterns}}
-            where text_patterns are strings that were compiled into patterns
-        '''
-        # check to see if the new text has at least one fewer instance of the 
-        # search pattern
-        for i, pattern in enumerate(patterns):
-            if len(pattern.findall(og_text)) > len(pattern.findall(new_text)):
-                brute_results['c'][text_patterns[i]] += 1
-                return True
-        return False
-    
     # initialize search items
     brute_search_matches = []
     brute_search_unmatched = []
@@ -128,38 +312,65 @@ def find_matches_pdftotext(f, text_patterns, envs, og_file=None, raw=False):
     else:
         patterns = [re.compile(e.decode('utf-8')) for e in text_patterns]
     
-    # Using pdftotext python library to read text
-    # all manipulations are done in memory so hopefull this is quick
-    # produce original text
-    og_text = pdftotext.PDF(f, raw=raw)
     # get original pdf file
     if not og_file:
         f.seek(0)
         og_file = f.read()
+    # Using pdftotext python library to read text
+    # all manipulations are done in memory so hopefull this is quick
+    # produce original text from the pdf already in memory, like the edited
+    # ones, instead of reading f again
+    with BytesIO(og_file) as g:
+        og_pages = list(pdftotext.PDF(g, raw=raw))
+    # the original text doesn't change so count the instances of the patterns
+    # in each page only once
+    og_counts = [[count_matches(pattern, page) for pattern in patterns]
+                    for page in og_pages]
     # remove text in each range once, one by one, checking for diffs in each page
-    tmp_pdf_file = filenames.fileOut(
-                    re.sub('.pdf', '_tmp_whiteout_re.pdf', f.name),
-                    overwrite=True)
-    exists_text = re.compile(rb'[\(<].*?[\)>] *?Tj')
-    for env in envs:
-        with open(tmp_pdf_file, 'w+b') as g:
-            # if the object has no text, skip it
-            if not exists_text.search(og_file[env.start() : env.end()]):
+    # if the object has no text, skip it
+    text_envs = [env for env in envs 
+                    if TEXT_EXISTS.search(og_file, env.start(), env.end())]
+    args = (og_file, patterns, og_pages, og_counts, raw)
+    if current_process().daemon or not text_envs:
+        # daemonic processes, e.g. the workers of prepare -P, can't have a Pool
+        hits = map(lambda span: text_removed(span, *args), 
+                    [env.span() for env in text_envs])
+        pool = None
+    else:
+        # each env is independent and pdftotext dominates, so use all cores
+        # the pdf is sent once to each worker instead of once per env
+        n_procs = os.cpu_count() or 1
+        pool = Pool(n_procs, initializer=init_text_removed, initargs=args)
+        # hand the spans out in chunks, as Pool.map would, to save round trips
+        chunksize = max(1, len(text_envs) // (4 * n_procs))
+        hits = pool.imap(text_removed_worker, [env.span() for env in text_envs],
+                    chunksize=chunksize)
+    # the results are collected in order, but envs found below are removed 
+    # from envs while iterating, and their results are never used
+    text_iter = iter(text_envs)
+    text_ids = set(id(env) for env in text_envs)
+    pending = {}
+    # the envs matched by new patterns are moved out of envs while iterating
+    # over a copy of it, and skipped when they come up
+    moved_ids = set()
+    try:
+        for env in list(envs):
+            if id(env) in moved_ids:
+                continue
+            if id(env) not in text_ids:
                 brute_search_unmatched.append(env)
                 continue
-            g.write(whiteout_pdf_str(og_file, env))
-            g.seek(0)
-            try:
-                tmp_text = pdftotext.PDF(g, raw=raw)
-            except pdftotext.Error as e:
-                print(f'Warning: pdftotext.Error: {e}')
+            while id(env) not in pending:
+                pending[id(next(text_iter))] = next(hits)
+            page_hits = pending.pop(id(env))
+            if page_hits is None:
                 brute_search_unmatched.append(env)
                 continue
             try:
                 is_match = False
-                for i, page in enumerate(og_text):
-                    if patterns_removed_pdftotext(page, tmp_text[i],
-                                    patterns, brute_results):
+                for i, hit in enumerate(page_hits):
+                    if hit is not None:
+                        brute_results['c'][text_patterns[hit]] += 1
                         new_patterns = whiteout_pdf_str(og_file, env, just_match=True)
                         # for some reason, some badly constructed pdfs may lose
                         # their text, as seen by pdftotext, if certain objects
@@ -180,16 +391,19 @@ def find_matches_pdftotext(f, text_patterns, envs, og_file=None, raw=False):
                             og_file, new_patterns, ['c'], rb'\n\d+ \d+ obj.*?endobj')
                         # this includes the original one! so we include it even
                         # if it is unique
-                        # yay, lists are mutable so I can edit the list I'm
-                        # iterating over, which is envs. 
                         # remove the new matches from the search space at the
-                        # same time as adding them to the matched results
-                        [brute_search_matches.append(envs.pop(i)) 
-                                for i,m in enumerate(envs) if m.__repr__() in 
-                                [e.__repr__() for e in new_matches]]
+                        # same time as adding them to the matched results, in
+                        # one pass over envs
+                        new_spans = set(m.span() for m in new_matches)
+                        kept, moved = [], []
+                        for m in envs:
+                            (moved if m.span() in new_spans else kept).append(m)
+                        envs[:] = kept
+                        brute_search_matches.extend(moved)
+                        moved_ids.update(id(m) for m in moved)
                         # I would like to update the search results with this
                         # added to the pattern matched in
-                        # patterns_removed_pdftotext but here is a compromise
+                        # text_removed but here is a compromise
                         brute_results['c'].update(new_results['c'])
                         break
                     else:
@@ -198,8 +412,12 @@ def find_matches_pdftotext(f, text_patterns, envs, og_file=None, raw=False):
                     brute_search_unmatched.append(env)
             except BaseException as e:
                 print(f'Warning: {e}')
-
-    os.remove(tmp_pdf_file)
+    finally:
+        if pool is not None:
+            # some results may belong to envs that were removed, and after
+            # an error the workers aren't needed either
+            pool.terminate()
+            pool.join()
 
     return (brute_search_matches, brute_search_unmatched, brute_results)
 
@@ -218,19 +436,63 @@ def whiteout_pdf_str(file_str, match, just_match=False):
         else:
         byte_str: file_str with substitutions 
     '''
-    p = re.compile(rb'([\(<])(.*?)([\)>] *?Tj\n)')
+    return whiteout_pdf_span(file_str, match.span(), just_match)
+
+
+def whiteout_pdf_span(file_str, span, just_match=False):
+    '''
+    The same as whiteout_pdf_str, but restricts to a span (start, end) 
+    instead of the span of a match, since matches can't be pickled
+    '''
+    start, end = span
     if just_match:
-        return [m.group(2) for m in p.finditer(file_str[match.start() :match.end()])]
-    # due to additional insertions required of escape strings and the
-    # character index approach, the matches are removed in reverse order
+        return [m.group(2) for m in TEXT_OBJ.finditer(file_str, start, end)]
     else:
-        for m in reversed(list(p.finditer(file_str[match.start() : match.end()]))):
-            replace = b''.join([b'\xA0' for e in m.group(2)]) \
-                    + b'\xA0'*sum([len(re.findall(e, m.group(2))) for e in ESC_SEQS])
-            file_str = b''.join([file_str[ :match.start()+m.start()],
-                                m.group(1), replace, m.group(3),
-                                file_str[match.start()+m.end()+1: ]]) 
-        return file_str
+        return whiteout_pdf_spans(file_str, [span])
+
+
+def whiteout_pdf_spans(file_str, spans):
+    '''
+    Whites out the text in every span (start, end) of file_str in one pass
+    and returns the new string. Repeated or overlapping spans are only
+    whited out once
+    '''
+    with memoryview(file_str) as view:
+        return b''.join(whiteout_pdf_pieces(file_str, view, spans))
+
+
+def whiteout_pdf_pieces(file_str, view, spans):
+    '''
+    Yields the pieces of file_str with the text in every span whited out, as
+    in whiteout_pdf_spans, without joining them. The unchanged pieces are
+    slices of view, a memoryview of file_str, so they aren't copied
+    '''
+    # the pieces between the matches are taken from the original, so the
+    # indices of the matches stay valid even though the escape strings
+    # require additional insertions
+    prev = 0
+    for start, end in sorted(set(spans)):
+        if start < prev:
+            continue
+        yield view[prev : start]
+        # re.sub assembles the whited out span in one piece
+        yield TEXT_OBJ.sub(whiteout_text_obj, view[start : end])
+        prev = end
+    yield view[prev: ]
+
+
+def whiteout_text_obj(m):
+    '''
+    Returns the text object matched by TEXT_OBJ with its text whited out
+    '''
+    text = m.group(2)
+    # one space per byte of the text, and one more per escape sequence
+    replace = text.translate(WHITEOUT_TABLE)
+    n_esc = (len(text) - len(text.translate(None, ESC_SEQ_BYTES))
+            + sum([len(e.findall(text)) for e in ESC_SEQ_PATTERNS]))
+    if n_esc:
+        replace += b'\xA0' * n_esc
+    return b''.join([m.group(1), replace, m.group(3)])
 
 
 def print_search_dict(results):
@@ -238,8 +500,12 @@ def print_search_dict(results):
     Prints the search dictionary in an easily readable format
     '''
     # formats are first level and patterns the second but I want to flip this when printing
-    for pattern in results['c']:
-        data = {e : results[e][pattern] for e in results.keys()}
+    # so transpose the dictionary in one pass over it
+    transposed = {pattern : {} for pattern in results['c']}
+    for e, counts in results.items():
+        for pattern, count in counts.items():
+            transposed[pattern][e] = count
+    for pattern, data in transposed.items():
         total = sum(data.values())
         print(f'Matched {total} times in total with format distribution {data}\n\t{pattern}\n')
     return 
@@ -250,8 +516,7 @@ def reverse_sort_matches(matches):
     This take in a list of match objects and sort them in descending order by
     the value of their start attribute. Returns a sorted list of these objects.
     '''
-    starts = [m.start() for m in matches]
-    return [m for _,m in sorted(zip(starts, matches), reverse=True)]
+    return sorted(matches, key=(lambda m: m.start()), reverse=True)
 
 
 # Main script
@@ -287,14 +552,11 @@ def whiteout_pdf_text(pattern_file, input_file, output_file, formats,
                                         search_unmatched_envs, og_file, raw)
             search_matched_envs += new_matched_envs
 
-    with output_file as g:
-        # whiteout replaces each matching byte with a space so indices same
-        new_file = og_file
-        # due to additional insertions required of escape strings and the
-        # character index approach, the matches are removed in reverse order
-        for m in reverse_sort_matches(search_matched_envs):
-            new_file = whiteout_pdf_str(new_file, m)
-        g.write(new_file)
+    with output_file as g, memoryview(og_file) as og_view:
+        # all the matches are whited out in one pass over the original, and
+        # its unchanged pieces are written from og_file without copying
+        g.writelines(whiteout_pdf_pieces(og_file, og_view,
+                        [m.span() for m in search_matched_envs]))
 
     if show_matches:
         print('Matched ranges:')
@@ -332,7 +594,7 @@ def cli():
             help='enter the name or path to write to')
     parser.add_argument(
             '-f', dest='format', 
-            default=set('c'), type=(lambda x: list(set(['c'] + [e for e in x]))),
+            default=['c'], type=(lambda x: list(dict.fromkeys(['c', *x]))),
             help='Delete literal or hex encodings of the search pattern.'
                 ' Options \'cxX\'.')
     parser.add_argument(
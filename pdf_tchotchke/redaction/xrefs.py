@@ -5,6 +5,7 @@
 # Last Updated Feb 13, 2021
 
 import re
+from itertools import islice
 
 from .patterns import *
 from .parser import *
@@ -21,11 +22,12 @@ class pdf_xrefs(pdf_matches):
     but we also want to track the startxref block, so see the re P['xrefs']
     '''
     def __init__(self, iterator, origin):
-        xrefs = list(iterator)
+        # only take the first two matches, to check that there is just one
+        xrefs = list(islice(iterator, 2))
         try:
             assert len(xrefs)==1
         except AssertionError:
-            raise AssertionError('bad pdf? more than one startxref in document')
+            raise AssertionError('bad pdf? not one startxref in document')
         self.match= xrefs[0] # this is a match object
         self.where = self.match.group(2)
         super().__init__(pdf_match(self.match, origin).finditer(P['xref']), origin, pdf_xref)
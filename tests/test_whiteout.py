@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+# test_whiteout.py
+# Tests of the pattern searches of whiteout.py and whiteout_re.py
+# Run with: python -m unittest discover tests
+
+import unittest
+
+try:
+    from pdf_tchotchke.redaction import whiteout, whiteout_re
+except ImportError: # pdftotext is needed to import the modules
+    whiteout = whiteout_re = None
+
+LINES = [b'1 0 obj\n', b'(zz) Tj\n', b'endobj\n',
+         b'3 0 obj\n', b'(xyxy) Tj\n', b'endobj\n']
+OBJ_BEG = rb'^\d+ 0 obj'
+OBJ_END = rb'^endobj'
+PDF = b''.join([b'%PDF\n', *LINES, b'4 0 obj\n(buzz) Tj\nendobj\n'])
+OBJ = rb'\n\d+ \d+ obj.*?endobj'
+
+
+@unittest.skipIf(whiteout is None, 'pdftotext is not installed')
+class TestWhiteoutPatterns(unittest.TestCase):
+    '''
+    The patterns which can't be combined in one regexp are searched one by one
+    '''
+    def find(self, patterns, formats=['c']):
+        matched, _, results = whiteout.findEnvAndMatchRanges(LINES, patterns,
+                                    formats, OBJ_BEG, OBJ_END)
+        return matched, results
+
+    def test_backreference_after_first_pattern(self):
+        patterns = [rb'zz', rb'(xy)\1']
+        self.assertIsNone(whiteout.compilePatterns(tuple(patterns), ('c',))[0])
+        matched, results = self.find(patterns)
+        self.assertEqual(matched, [range(0, 3), range(3, 6)])
+        self.assertEqual(results['c'], {rb'zz': 1, rb'(xy)\1': 1})
+
+    def test_inline_flags(self):
+        matched, results = self.find([rb'foo', rb'(?i)XYXY'])
+        self.assertEqual(matched, [range(3, 6)])
+        self.assertEqual(results['c'], {rb'foo': 0, rb'(?i)XYXY': 1})
+
+    def test_combined(self):
+        patterns = [rb'zz', rb'x(y)x']
+        self.assertIsNotNone(
+                whiteout.compilePatterns(tuple(patterns), ('c',))[0])
+        matched, results = self.find(patterns)
+        self.assertEqual(matched, [range(0, 3), range(3, 6)])
+        self.assertEqual(results['c'], {rb'zz': 1, rb'x(y)x': 1})
+
+
+
+@unittest.skipIf(whiteout_re is None, 'pdftotext is not installed')
+class TestWhiteoutRePatterns(unittest.TestCase):
+    '''
+    The patterns which can't be combined in one regexp are searched one by one
+    '''
+    def find(self, patterns, formats=['c']):
+        matched, _, results = whiteout_re.find_env_matches(PDF, patterns,
+                                    formats, OBJ)
+        return [PDF[slice(*m.span())] for m in matched], results
+
+    def test_backreference_after_first_pattern(self):
+        for formats in (['c'], ['x', 'c']):
+            matched, results = self.find([rb'(f)oo', rb'(z)\1'], formats)
+            self.assertEqual(matched, [b'\n1 0 obj\n(zz) Tj\nendobj',
+                                        b'\n4 0 obj\n(buzz) Tj\nendobj'])
+            self.assertEqual(results['c'], {rb'(f)oo': 0, rb'(z)\1': 2})
+
+    def test_named_backreference(self):
+        matched, results = self.find([rb'yy', rb'(?P<a>x)y(?P=a)'])
+        self.assertEqual(matched, [b'\n3 0 obj\n(xyxy) Tj\nendobj'])
+        self.assertEqual(results['c'], {rb'yy': 0, rb'(?P<a>x)y(?P=a)': 1})
+
+    def test_combined(self):
+        patterns = [rb'zz', rb'x(y)x']
+        self.assertIsNotNone(
+                whiteout_re.compile_patterns(tuple(patterns), ('c',))[1])
+        matched, results = self.find(patterns)
+        self.assertEqual(len(matched), 3)
+        self.assertEqual(results['c'], {rb'zz': 2, rb'x(y)x': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()